@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+import argparse
+from xml.etree.cElementTree import fromstring
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "scripts"))
+from decoder import extractEncrypt, decodeMessage
+
+
+envelope = b"""<xml><ToUserName><![CDATA[wx5823bf96d3bd56c7]]></ToUserName><Encrypt><![CDATA[RypEvHKD8QQKFhvQ6QleEB4J58tiPdvo+rtK1I9qca6aM/wvqnLSV5zEPeusUiX5L5X/0lWfrf0QADHHhGd3QczcdCUpj911L3vg3W/sYYvuJTs3TUUkSUXxaccAS0qhxchrRYt66wiSpGLYL42aM6A8dTT+6k4aSknmPj48kzJs8qLjvd4Xgpue06DOdnLxAUHzM6+kDZ+HMZfJYuR+LtwGc2hgf5gsijff0ekUNXZiqATP7PF5mZxZ3Izoun1s4zG4LUMnvw2r+KqCKIw+3IQH03v+BCA9nMELNqbSf6tiWSrXJB3LAVGUcallcrw8V2t9EL4EhzJWrQUax5wLVMNS0+rUPA3k22Ncx4XXZS9o0MBH27Bo6BpNelZpS]]></Encrypt><AgentID><![CDATA[218]]></AgentID></xml>"""
+message = """<xml><ToUserName><![CDATA[wx5823bf96d3bd56c7]]></ToUserName><FromUserName><![CDATA[mycreate]]></FromUserName><CreateTime>1409659813</CreateTime><MsgType><![CDATA[text]]></MsgType><Content><![CDATA[今天天气怎么样]]></Content><MsgId>4561255354251345929</MsgId><AgentID>218</AgentID></xml>""".encode("utf-8")
+
+
+def decodeWithElementTree():
+    fromstring(envelope).find("Encrypt").text
+    xmlTree = fromstring(message)
+    (xmlTree.find("FromUserName").text, xmlTree.find("MsgType").text,
+     xmlTree.find("Content").text, xmlTree.findtext("MsgId"), xmlTree.findtext("CreateTime"))
+
+
+def decodeWithScanner():
+    extractEncrypt(envelope)
+    decodeMessage(message)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure callbacks decoded per second by the double ElementTree parse and the single-pass decoder.")
+    parser.add_argument("-n", "--count", type=int, default=200000)
+    arguments = parser.parse_args()
+    for name, decode in (("ElementTree twice (before)", decodeWithElementTree), ("byte scanner (after)", decodeWithScanner)):
+        startTime = time.perf_counter()
+        for _ in range(arguments.count):
+            decode()
+        elapsed = time.perf_counter() - startTime
+        print("{:<28}{:>12.0f} callbacks/s".format(name,
+                                                   arguments.count / elapsed))
@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "scripts"))
+from trigger import cronTrigger
+
+
+def naiveNextFireTime(trigger, previousFireTime):
+    masks = trigger.masks
+    localTime = (previousFireTime + trigger.utcOffset +
+                 timedelta(seconds=1)).replace(microsecond=0)
+    while True:
+        if (masks["month"] >> localTime.month & 1 and masks["day"] >> localTime.day & 1 and masks["dayOfWeek"] >> localTime.weekday() & 1
+                and masks["hour"] >> localTime.hour & 1 and masks["minute"] >> localTime.minute & 1):
+            for second in range(localTime.second, 60):
+                if masks["second"] >> second & 1:
+                    return localTime.replace(second=second) - trigger.utcOffset
+        localTime = localTime.replace(second=0) + timedelta(minutes=1)
+
+
+def benchmark(name, trigger, nextFireTime, count):
+    fireTime = datetime(2026, 1, 1)
+    startTime = time.perf_counter()
+    for _ in range(count):
+        fireTime = nextFireTime(trigger, fireTime)
+    elapsed = time.perf_counter() - startTime
+    print("{:<44}{:>12.0f} fires/s".format(name, count / elapsed))
+    return fireTime
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure cron next-fire computations per second against a minute-by-minute scan.")
+    parser.add_argument("-n", "--count", type=int, default=2000)
+    arguments = parser.parse_args()
+    schedules = (("every 15 minutes", {"minute": "*/15"}),
+                 ("working hours on weekdays", {"dayOfWeek": "mon-fri", "hour": "9-18", "minute": 30}),
+                 ("daily digest", {"hour": 9}),
+                 ("monthly report", {"day": 1, "hour": 8}))
+    for name, fields in schedules:
+        trigger = cronTrigger(**fields)
+        bitsetLast = benchmark("{} (bitsets)".format(name), trigger, lambda trigger, fireTime: trigger.getNextFireTime(
+            fireTime, fireTime), arguments.count)
+        naiveLast = benchmark("{} (naive scan)".format(name), trigger,
+                              naiveNextFireTime, arguments.count)
+        assert bitsetLast == naiveLast
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import base64
+import argparse
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "scripts"))
+from configs import config
+if not config["cryptKey"]:
+    config["cryptKey"] = base64.b64encode(os.urandom(32)).decode("utf-8")[:-1]
+    config["cryptToken"] = "benchmarkToken"
+    config["corpId"] = "benchmarkCorpId"
+from crypt import encryptMsg, decryptMsg
+from decoder import scanField
+
+
+def benchmark(name, func, count):
+    startTime = time.perf_counter()
+    for _ in range(count):
+        func()
+    elapsed = time.perf_counter() - startTime
+    print("{:<34}{:>12.0f} ops/s".format(name, count / elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure verify+decrypt and encrypt+sign throughput for several payload sizes.")
+    parser.add_argument("-n", "--count", type=int, default=20000)
+    parser.add_argument("-s", "--sizes", type=int, nargs="+",
+                        default=[256, 4096, 65536])
+    arguments = parser.parse_args()
+    nonce = "1372623149"
+    timestamp = "1409659813"
+    for size in arguments.sizes:
+        message = "<xml><Content><![CDATA[{}]]></Content></xml>".format(
+            "a" * size)
+        packet = encryptMsg(message, nonce, timestamp)
+        postData = packet.encode("utf-8")
+        msgSignature = scanField(postData, b"MsgSignature", True)[0]
+        benchmark("encrypt+sign {} bytes".format(size),
+                  lambda: encryptMsg(message, nonce, timestamp), arguments.count)
+        benchmark("verify+decrypt {} bytes".format(size),
+                  lambda: decryptMsg(postData, msgSignature, timestamp, nonce), arguments.count)
@@ -0,0 +1,80 @@
+import os
+import sys
+import ssl
+import time
+import asyncio
+import argparse
+import aiohttp
+from tornado import web, httpserver, netutil
+from tornado.ioloop import IOLoop
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "scripts"))
+from client import pooledClient
+
+
+class stubHandler(web.RequestHandler):
+    def post(self):
+        self.write({"errcode": 0, "errmsg": "ok"})
+
+
+def startStubServer(certFile, keyFile):
+    sslContext = None
+    if certFile is not None:
+        sslContext = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        sslContext.load_cert_chain(certFile, keyFile)
+    sockets = netutil.bind_sockets(0, "127.0.0.1")
+    server = httpserver.HTTPServer(web.Application(
+        [(r"/cgi-bin/message/send", stubHandler)]), ssl_options=sslContext)
+    server.add_sockets(sockets)
+    scheme = "https" if sslContext is not None else "http"
+    return server, "{}://127.0.0.1:{}/cgi-bin/message/send".format(scheme, sockets[0].getsockname()[1])
+
+
+async def sendWithFreshSessions(url, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(index):
+        async with semaphore:
+            async with aiohttp.ClientSession() as session:
+                response = await session.post(url, json={"content": index}, ssl=False)
+                await response.json()
+    await asyncio.gather(*[send(index) for index in range(count)])
+
+
+async def sendWithPooledClient(url, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    client = pooledClient(poolSize=concurrency)
+    await client.start(url)
+
+    async def send(index):
+        async with semaphore:
+            response = await client.post(url, json={"content": index}, ssl=False)
+            await response.json()
+    await asyncio.gather(*[send(index) for index in range(count)])
+    await client.close()
+
+
+async def benchmark(arguments):
+    server, url = startStubServer(arguments.certFile, arguments.keyFile)
+    print("Sending {} messages to {} with concurrency {}.".format(
+        arguments.count, url, arguments.concurrency))
+    for name, sender in (("fresh session per call", sendWithFreshSessions), ("pooled client", sendWithPooledClient)):
+        startTime = time.perf_counter()
+        await sender(url, arguments.count, arguments.concurrency)
+        elapsed = time.perf_counter() - startTime
+        print("{:<24}{:>10.3f}s{:>12.1f} msg/s{:>10.2f} ms/msg".format(name,
+                                                                       elapsed, arguments.count / elapsed, elapsed * 1000 / arguments.count))
+    server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure outbound latency of fresh sessions versus the pooled http client against a local stub server.")
+    parser.add_argument("-n", "--count", type=int, default=1000)
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    parser.add_argument("--certFile", default=None,
+                        help="serve the stub over https to include tls handshakes")
+    parser.add_argument("--keyFile", default=None)
+    IOLoop.current().run_sync(lambda: benchmark(parser.parse_args()))
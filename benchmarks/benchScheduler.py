@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+from datetime import datetime, timedelta
+from tornado.ioloop import IOLoop
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "scripts"))
+from scheduler import tornadoScheduler
+
+
+async def noop():
+    pass
+
+
+async def fillScheduler(scheduler, count, dueCount):
+    dueTime = datetime.utcnow() - timedelta(seconds=1)
+    for index in range(count):
+        jobArgs = {"nextRunTime": dueTime} if index < dueCount else {}
+        await scheduler.addJob("job{}".format(index), noop, triggerName="interval", hours=1, **jobArgs)
+
+
+async def benchmark(arguments):
+    with tempfile.TemporaryDirectory() as directory:
+        scheduler = tornadoScheduler(os.path.join(
+            directory, "tasks.db"), ["static", "custom", "temporary"])
+        await scheduler.start(paused=True)
+        await fillScheduler(scheduler, arguments.jobs, arguments.due)
+        wakeup = scheduler._tornadoScheduler__wakeup
+        await scheduler.resume()
+        startTime = time.perf_counter()
+        await wakeup()
+        elapsed = time.perf_counter() - startTime
+        print("{:<40}{:>12.3f} s".format(
+            "wakeup with {} due jobs".format(arguments.due), elapsed))
+        startTime = time.perf_counter()
+        for _ in range(arguments.count):
+            await wakeup()
+        elapsed = time.perf_counter() - startTime
+        print("{:<40}{:>12.0f} wakeups/s".format(
+            "idle wakeup with {} jobs".format(arguments.jobs), arguments.count / elapsed))
+        await scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure scheduler wakeups per second over a large job table.")
+    parser.add_argument("-j", "--jobs", type=int, default=10000)
+    parser.add_argument("-d", "--due", type=int, default=1000)
+    parser.add_argument("-n", "--count", type=int, default=1000)
+    arguments = parser.parse_args()
+    IOLoop.current().run_sync(lambda: benchmark(arguments))
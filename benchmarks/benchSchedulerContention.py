@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import argparse
+from datetime import datetime, timedelta
+from tornado.ioloop import IOLoop
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "scripts"))
+from scheduler import tornadoScheduler
+
+
+async def noop():
+    pass
+
+
+async def timedAddJob(scheduler, jobId):
+    startTime = time.perf_counter()
+    await scheduler.addJob(jobId, noop, triggerName="interval", hours=1)
+    return time.perf_counter() - startTime
+
+
+async def benchmark(arguments):
+    with tempfile.TemporaryDirectory() as directory:
+        scheduler = tornadoScheduler(os.path.join(
+            directory, "tasks.db"), ["static", "custom", "temporary"])
+        await scheduler.start(paused=True)
+        dueTime = datetime.utcnow() - timedelta(seconds=1)
+        for index in range(arguments.due):
+            await scheduler.addJob("due{}".format(index), noop, triggerName="interval", hours=1, nextRunTime=dueTime)
+        await scheduler.resume()
+        startTime = time.perf_counter()
+        wakeup = asyncio.ensure_future(scheduler._tornadoScheduler__wakeup())
+        await asyncio.sleep(0)
+        latencies = await asyncio.gather(*[timedAddJob(scheduler, "added{}".format(index)) for index in range(arguments.adds)])
+        addElapsed = time.perf_counter() - startTime
+        await wakeup
+        wakeupElapsed = time.perf_counter() - startTime
+        latencies.sort()
+        print("{:<36}{:>10.3f} s".format(
+            "wakeup with {} due jobs".format(arguments.due), wakeupElapsed))
+        print("{:<36}{:>10.3f} s".format(
+            "{} concurrent addJob calls".format(arguments.adds), addElapsed))
+        for name, latency in (("addJob latency p50", latencies[len(latencies) // 2]), ("addJob latency p99", latencies[len(latencies) * 99 // 100]),
+                              ("addJob latency max", latencies[-1])):
+            print("{:<36}{:>10.1f} ms".format(name, latency * 1000))
+        await scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure addJob latency while a wakeup processes many due jobs.")
+    parser.add_argument("-d", "--due", type=int, default=5000)
+    parser.add_argument("-a", "--adds", type=int, default=1000)
+    arguments = parser.parse_args()
+    IOLoop.current().run_sync(lambda: benchmark(arguments))
@@ -0,0 +1,97 @@
+import asyncio
+from tornado.ioloop import IOLoop
+from collections import OrderedDict
+
+
+from configs import config, wechatTextMaxBytes, wechatMaxRecipients, priorityScheduled
+from log import generalLogger
+from metrics import counter
+
+
+def mergeParts(parts, maxBatchSize, maxBytes=wechatTextMaxBytes):
+    chunks = []
+    contents = []
+    futures = []
+    size = 0
+    for content, future in parts:
+        contentSize = len(content.encode("utf-8"))
+        if contents and (len(contents) >= maxBatchSize or size + 1 + contentSize > maxBytes):
+            chunks.append(("\n".join(contents), futures))
+            contents = []
+            futures = []
+            size = 0
+        size += contentSize + (1 if contents else 0)
+        contents.append(content)
+        futures.append(future)
+    if contents:
+        chunks.append(("\n".join(contents), futures))
+    return chunks
+
+
+class messageBatcher():
+    def __init__(self, send, flushWindow=None, maxBatchSize=None):
+        self.flushWindow = flushWindow if flushWindow is not None else config["wechatFlushWindow"]
+        self.maxBatchSize = maxBatchSize if maxBatchSize is not None else config["wechatMaxBatchSize"]
+        self.__send = send
+        self.__pending = OrderedDict()
+        self.__priorities = {}
+        self.__timeout = None
+        self.__submitted = counter(
+            "wechat_messages_submitted_total", "Wechat messages handed to the batcher.")
+        self.__sent = counter("wechat_payloads_sent_total",
+                              "Wechat message/send payloads sent by the batcher.")
+        self.__saved = counter("wechat_api_calls_saved_total",
+                               "Wechat message/send calls saved by coalescing and fan-out.")
+
+    def submit(self, content, touser=None, toparty=None, priority=priorityScheduled):
+        key = ("touser", touser) if toparty is None else ("toparty", toparty)
+        future = asyncio.get_event_loop().create_future()
+        parts = self.__pending.setdefault(key, [])
+        parts.append((content, future))
+        self.__priorities[key] = min(
+            self.__priorities.get(key, priority), priority)
+        self.__submitted.inc()
+        if len(parts) >= self.maxBatchSize:
+            IOLoop.current().add_callback(self.flush)
+        elif self.__timeout is None:
+            self.__timeout = IOLoop.current().call_later(
+                self.flushWindow, self.flush)
+        return future
+
+    async def flush(self):
+        if self.__timeout is not None:
+            IOLoop.current().remove_timeout(self.__timeout)
+            self.__timeout = None
+        pending, self.__pending = self.__pending, OrderedDict()
+        priorities, self.__priorities = self.__priorities, {}
+        payloads = OrderedDict()
+        submittedCount = 0
+        for key, parts in pending.items():
+            field, recipient = key
+            submittedCount += len(parts)
+            for content, futures in mergeParts(parts, self.maxBatchSize):
+                recipients, payloadFutures, priority = payloads.get(
+                    (field, content), ([], [], priorities[key]))
+                recipients.append(recipient)
+                payloadFutures.extend(futures)
+                payloads[(field, content)] = (recipients, payloadFutures, min(
+                    priority, priorities[key]))
+        sends = []
+        for (field, content), (recipients, futures, priority) in payloads.items():
+            for index in range(0, len(recipients), wechatMaxRecipients):
+                sends.append((self.__send(content=content, priority=priority, **{field: "|".join(
+                    str(recipient) for recipient in recipients[index:index + wechatMaxRecipients])}), futures))
+        if not sends:
+            return
+        self.__sent.inc(len(sends))
+        self.__saved.inc(submittedCount - len(sends))
+        generalLogger.debug("Flushing {} wechat message(s) in {} payload(s).".format(
+            submittedCount, len(sends)))
+        results = await asyncio.gather(*[send for send, _ in sends], return_exceptions=True)
+        outcomes = {}
+        for (_, futures), result in zip(sends, results):
+            for future in futures:
+                outcomes[future] = outcomes.get(future, True) and result is True
+        for future, outcome in outcomes.items():
+            if not future.done():
+                future.set_result(outcome)
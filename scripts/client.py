@@ -0,0 +1,77 @@
+import asyncio
+import aiohttp
+from urllib.parse import urlsplit
+
+
+from configs import config, qywxApiUrl, weiboApiUrl, priorityScheduled
+from log import generalLogger
+from limiter import rateLimiter
+
+
+class pooledClient():
+    def __init__(self, poolSize=None, keepaliveTimeout=None, dnsCacheTtl=None, timeout=None):
+        self.poolSize = poolSize if poolSize is not None else config["httpPoolSize"]
+        self.keepaliveTimeout = keepaliveTimeout if keepaliveTimeout is not None else config[
+            "httpKeepaliveTimeout"]
+        self.dnsCacheTtl = dnsCacheTtl if dnsCacheTtl is not None else config["httpDnsCacheTtl"]
+        self.timeout = timeout if timeout is not None else config["httpTimeout"]
+        self.__sessions = {}
+        self.__limiters = {}
+        self.__started = False
+
+    async def start(self, *urls):
+        if self.__started:
+            generalLogger.error("Http client already started.")
+            raise RuntimeError("Http client already started.")
+        self.__started = True
+        for url in urls:
+            self.getSession(url)
+        generalLogger.info("Http client started.")
+
+    async def close(self):
+        if not self.__started:
+            return
+        self.__started = False
+        for session in self.__sessions.values():
+            await session.close()
+        self.__sessions.clear()
+        await asyncio.sleep(0.25)
+        generalLogger.info("Http client closed.")
+
+    def setLimiter(self, url, limiter):
+        self.__limiters[urlsplit(url).netloc] = limiter
+
+    def getSession(self, url):
+        host = urlsplit(url).netloc
+        session = self.__sessions.get(host)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.poolSize, limit_per_host=self.poolSize,
+                                             keepalive_timeout=self.keepaliveTimeout, ttl_dns_cache=self.dnsCacheTtl)
+            session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self.__sessions[host] = session
+            generalLogger.debug(
+                "Created connection pool for host {}.".format(host))
+        return session
+
+    async def request(self, method, url, priority=priorityScheduled, **kwargs):
+        limiter = self.__limiters.get(urlsplit(url).netloc)
+        if limiter is not None:
+            await limiter.acquire(priority)
+        async with self.getSession(url).request(method, url, **kwargs) as response:
+            await response.read()
+        return response
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+
+httpClient = pooledClient()
+httpClient.setLimiter(qywxApiUrl, rateLimiter(
+    "wechat", config["wechatApiRate"], config["wechatApiBurst"]))
+httpClient.setLimiter(weiboApiUrl, rateLimiter(
+    "weibo", config["weiboApiRate"], config["weiboApiBurst"]))
+defaultHosts = (qywxApiUrl, weiboApiUrl)
@@ -0,0 +1,139 @@
+import os
+import time
+import fcntl
+import asyncio
+import aiosqlite
+
+
+from configs import config, dataBaseDir, cacheFilePath, relayTableStructure
+from log import generalLogger
+from metrics import counter
+
+
+def getWorkerCount():
+    workerCount = config["workerProcesses"]
+    return workerCount if workerCount > 0 else os.cpu_count()
+
+
+class leaderElection():
+    def __init__(self, lockFilePath, interval=None):
+        self.lockFilePath = lockFilePath
+        self.interval = interval if interval is not None else config["leaderElectionInterval"]
+        self.isLeader = getWorkerCount() == 1
+        self.__lockFile = None
+        self.__task = None
+
+    def elect(self):
+        if self.isLeader:
+            return True
+        self.__lockFile = open(self.lockFilePath, "a")
+        try:
+            fcntl.flock(self.__lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.__lockFile.close()
+            self.__lockFile = None
+            return False
+        self.__lockFile.truncate(0)
+        self.__lockFile.write(str(os.getpid()))
+        self.__lockFile.flush()
+        self.isLeader = True
+        generalLogger.info(
+            "Worker {} has been elected to run the scheduler.".format(os.getpid()))
+        return True
+
+    def start(self, onElected):
+        self.__task = asyncio.ensure_future(self.__run(onElected))
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+    async def __run(self, onElected):
+        while not self.elect():
+            await asyncio.sleep(self.interval)
+        generalLogger.info(
+            "Worker {} is taking over the scheduler and weibo chats.".format(os.getpid()))
+        try:
+            await onElected()
+        except Exception as e:
+            generalLogger.warning(
+                "Unable to take over as the elected worker, here is the error message:\n{}".format(e))
+
+    def release(self):
+        if self.__lockFile is not None:
+            fcntl.flock(self.__lockFile, fcntl.LOCK_UN)
+            self.__lockFile.close()
+            self.__lockFile = None
+
+
+class chatRelay():
+    def __init__(self, dataBaseFilePath, tableName, pollInterval=None, batchSize=None):
+        self.tableName = tableName
+        self.pollInterval = pollInterval if pollInterval is not None else config[
+            "relayPollInterval"]
+        self.batchSize = batchSize if batchSize is not None else config["workQueueSize"]
+        self.__dataBaseFilePath = dataBaseFilePath
+        self.__dataBase = None
+        self.__task = None
+        self.__forwarded = counter("relay_chats_forwarded_total",
+                                   "Chats forwarded by a worker to the elected worker.")
+        self.__received = counter("relay_chats_received_total",
+                                  "Forwarded chats picked up by the elected worker.")
+
+    async def open(self):
+        self.__dataBase = await aiosqlite.connect(self.__dataBaseFilePath)
+        await self.__dataBase.execute("pragma journal_mode=wal")
+        await self.__dataBase.execute("create table if not exists {} ({})".format(self.tableName, relayTableStructure))
+        await self.__dataBase.commit()
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+    async def close(self):
+        await self.stop()
+        if self.__dataBase is not None:
+            await self.__dataBase.close()
+            self.__dataBase = None
+
+    async def forward(self, fromId, content):
+        await self.__dataBase.execute("insert into {} (fromId, content, createTime) values (?, ?, ?)".format(self.tableName),
+                                      (fromId, content, time.time()))
+        await self.__dataBase.commit()
+        self.__forwarded.inc()
+        generalLogger.info(
+            "Forwarded the chat of {} to the elected worker.".format(fromId))
+
+    def start(self, handler):
+        self.__task = asyncio.ensure_future(self.__run(handler))
+
+    async def __run(self, handler):
+        while True:
+            try:
+                await self.__receive(handler)
+            except Exception as e:
+                generalLogger.warning(
+                    "Unable to receive forwarded chats, here is the error message:\n{}".format(e))
+            await asyncio.sleep(self.pollInterval)
+
+    async def __receive(self, handler):
+        async with self.__dataBase.execute("select id, fromId, content from {} order by id limit ?".format(self.tableName), (self.batchSize,)) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return
+        acceptedIds = []
+        for rowId, fromId, content in rows:
+            if not handler(fromId, content):
+                break
+            acceptedIds.append((rowId,))
+        await self.__dataBase.executemany("delete from {} where id = ?".format(self.tableName), acceptedIds)
+        await self.__dataBase.commit()
+        self.__received.inc(len(acceptedIds))
+
+
+leader = leaderElection(os.path.join(dataBaseDir, "leader.lock"))
+relay = chatRelay(cacheFilePath, config["relayTableName"])
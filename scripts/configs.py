@@ -18,7 +18,7 @@ dataBaseDir = os.path.join(
     projectDir, config["dataBaseDir"] if config["dataBaseDir"] is not None else "data")
 weiboHeaders = {
     "Host": "m.weibo.cn",
-    "Connection": "close",
+    "Connection": "keep-alive",
     "Accept": "application/json, text/plain, */*",
     "MWeibo-Pwa": "1",
     "X-XSRF-TOKEN": config["weiboHeaderCookie"].split("XSRF-TOKEN=")[-1],
@@ -36,8 +36,8 @@ weiboHeaders = {
 }
 globalState = {
     "wechatToken": None,
+    "wechatTokenExpireTime": 0,
     "wechatTokenAvailable": True,
-    "pendingWechatMessages": [],
     "weiboToken": weiboHeaders["X-XSRF-TOKEN"]
 }
 
@@ -95,20 +95,39 @@ logConfigDict = {
 
 qywxApiUrl = "https://qyapi.weixin.qq.com/cgi-bin"
 weiboApiUrl = "https://m.weibo.cn/api/chat"
+weiboBotId = 5175429989
+wechatTextMaxBytes = 2048
+wechatMaxRecipients = 1000
+weiboClockTolerance = 2
 
 
 cacheFilePath = os.path.join(dataBaseDir, "cache.db")
 cacheTableStructure = "key varchar(50) primary key, value blob not null"
+relayTableStructure = "id integer primary key autoincrement, fromId varchar(50) not null, content text, createTime float not null"
+dedupTableStructure = "key text primary key, expireTime float not null"
+outboxTableStructure = "id integer primary key autoincrement, payload blob not null, status integer not null, attempts integer not null, createTime float not null"
+outboxPending = 0
+outboxSending = 1
 starting = 0
 running = 1
 stopping = 2
 
 
+breakerClosed = 0
+breakerOpen = 1
+breakerHalfOpen = 2
+priorityChat = 0
+priorityScheduled = 1
+priorityPending = 2
+
+
 stateStopped = 0
 stateRunning = 1
 statePaused = 2
 jobStoreRetryInterval = 3
-jobStoreTableStructure = "id varchar(50) primary key, nextRunTime float(25), state blob not null"
+wakeupBatchSize = 256
+jobStoreTableStructure = "id varchar(50) primary key, nextRunTime float(25), lastRunTime float(25), definition blob not null"
+jobRuntimeFields = ("id", "nextRunTime", "lastRunTime")
 timeoutMax = 2629800
 tasksFilePath = os.path.join(dataBaseDir, "tasks.db")
 
@@ -120,3 +139,10 @@ passiveResponsePacket = '''<xml>
 <TimeStamp>{}</TimeStamp>
 <Nonce><![CDATA[{}]]></Nonce>
 </xml>'''
+passiveTextReply = '''<xml>
+<ToUserName><![CDATA[{}]]></ToUserName>
+<FromUserName><![CDATA[{}]]></FromUserName>
+<CreateTime>{}</CreateTime>
+<MsgType><![CDATA[text]]></MsgType>
+<Content><![CDATA[{}]]></Content>
+</xml>'''
@@ -0,0 +1,256 @@
+import time
+import html
+import asyncio
+from tornado import locks
+from tornado.util import TimeoutError
+from collections import deque
+from datetime import datetime, timedelta
+
+
+from configs import config, weiboApiUrl, weiboHeaders, weiboBotId, weiboClockTolerance, priorityChat
+from log import generalLogger
+from metrics import counter, gauge, histogram
+from client import httpClient
+from retry import getBreaker
+
+
+def parseWeiboTimestamp(createdAt):
+    return datetime.strptime(createdAt, "%a %b %d %H:%M:%S %z %Y").timestamp()
+
+
+def normalizeText(text):
+    return " ".join(html.unescape(text or "").split())
+
+
+class chatRequest():
+    def __init__(self, fromId, content):
+        self.fromId = fromId
+        self.content = content
+        self.sendTimestamp = None
+        self.anchorTimestamp = None
+        self.replyTimestamp = None
+        self.pollCount = 0
+        self.anchored = False
+        self.ambiguous = False
+        self.replies = []
+        self.lastReplySeen = None
+
+    def __str__(self):
+        return "chat of {} ({} reply part(s){})".format(self.fromId, len(self.replies), ", ambiguous" if self.ambiguous else "")
+
+    @property
+    def answered(self):
+        return self.ambiguous or bool(self.replies)
+
+    @property
+    def botLatency(self):
+        if self.anchorTimestamp is None or self.replyTimestamp is None:
+            return None
+        return max(self.replyTimestamp - self.anchorTimestamp, 0)
+
+
+class conversationTracker():
+    def __init__(self, botId=weiboBotId, listCount=10):
+        self.botId = botId
+        self.listCount = listCount
+        self.__cursor = None
+        self.__unanchored = deque()
+        self.__anchor = None
+
+    def register(self, request):
+        request.sendTimestamp = time.time()
+        self.__unanchored.append(request)
+
+    def unregister(self, request):
+        if request in self.__unanchored:
+            self.__unanchored.remove(request)
+
+    def feed(self, messages):
+        newMessages = [message for message in reversed(messages)
+                       if self.__cursor is None or message["id"] > self.__cursor]
+        if not newMessages:
+            return
+        if self.__cursor is not None and len(messages) >= self.listCount and newMessages[0] is messages[-1]:
+            generalLogger.warning(
+                "More than {} weibo messages arrived between two polls, the conversation order cannot be trusted.".format(self.listCount))
+            self.__poison()
+        for message in newMessages:
+            self.__cursor = message["id"]
+            if message["sender_id"] != self.botId:
+                self.__anchorMessage(message)
+            elif self.__anchor is not None:
+                if not self.__anchor.replies:
+                    self.__anchor.replyTimestamp = parseWeiboTimestamp(
+                        message["created_at"])
+                if message["media_type"] == 0:
+                    self.__anchor.replies.append(message["text"])
+                else:
+                    self.__anchor.replies.append("暂不支持显示非文本类消息哦~")
+                self.__anchor.lastReplySeen = time.time()
+
+    def __anchorMessage(self, message):
+        previous = self.__anchor
+        createTimestamp = parseWeiboTimestamp(message["created_at"])
+        candidates = [request for request in self.__unanchored
+                      if createTimestamp >= request.sendTimestamp - weiboClockTolerance]
+        text = normalizeText(message["text"])
+        request = next((request for request in candidates if normalizeText(
+            request.content) == text), None)
+        if request is None and len(candidates) == 1:
+            request = candidates[0]
+        if request is not None:
+            self.__unanchored.remove(request)
+            request.anchored = True
+            request.anchorTimestamp = createTimestamp
+        else:
+            generalLogger.warning(
+                "Found a weibo message not sent by this bot, ignoring the replies following it.")
+        if previous is not None and not previous.replies:
+            previous.ambiguous = True
+            if request is not None:
+                request.ambiguous = True
+                generalLogger.warning(
+                    "Previous chat was not answered before the next one was sent, dropping both to avoid misdelivery.")
+        self.__anchor = request
+
+    def __poison(self):
+        for request in self.__unanchored:
+            request.ambiguous = True
+        self.__unanchored.clear()
+        if self.__anchor is not None:
+            self.__anchor.ambiguous = True
+        self.__anchor = None
+
+
+class adaptivePoller():
+    def __init__(self, floor=None, ceiling=None, timeout=None, quietPeriod=None, window=None):
+        self.floor = floor if floor is not None else config["chatPollFloor"]
+        self.ceiling = ceiling if ceiling is not None else config["chatPollCeiling"]
+        self.timeout = timeout if timeout is not None else config["chatReplyTimeout"]
+        self.quietPeriod = quietPeriod if quietPeriod is not None else config[
+            "chatReplyQuietPeriod"]
+        self.__latencies = deque(
+            maxlen=window if window is not None else config["chatLatencyWindow"])
+        self.__replyLatency = histogram(
+            "chat_time_to_first_reply_seconds", "Time from sending a weibo message to seeing its first reply.")
+        self.__pollCount = histogram("chat_polls_per_request", "Weibo list polls needed per chat.", buckets=(
+            1, 2, 3, 4, 5, 6, 8, 10, 15, 20))
+
+    def percentile(self, ratio):
+        if not self.__latencies:
+            return None
+        latencies = sorted(self.__latencies)
+        return latencies[min(int(ratio * len(latencies)), len(latencies) - 1)]
+
+    def pollOffsets(self):
+        if self.__latencies:
+            points = [self.percentile(ratio)
+                      for ratio in (0.5, 0.75, 0.9, 0.99)]
+        else:
+            points = [defaultFirstPoll]
+        offset = 0
+        step = self.floor
+        for point in points:
+            point = min(max(point, self.floor), self.timeout)
+            if point - offset >= self.floor:
+                step = min(max(point - offset, self.floor), self.ceiling)
+                offset = point
+                yield offset
+        while offset < self.timeout:
+            step = min(step * 2, self.ceiling)
+            offset = min(offset + step, self.timeout)
+            yield offset
+
+    def record(self, request):
+        self.__pollCount.observe(request.pollCount)
+        if not request.replies:
+            return
+        timeToFirstReply = time.time() - request.sendTimestamp
+        self.__replyLatency.observe(timeToFirstReply)
+        if request.botLatency is not None:
+            self.__latencies.append(request.botLatency)
+        generalLogger.info("Got the reply of {} after {:.2f}s and {} poll(s), bot latency p50 {}s, p99 {}s.".format(
+            request, timeToFirstReply, request.pollCount, self.percentile(0.5), self.percentile(0.99)))
+
+
+class inboxPoller():
+    def __init__(self, tracker=None, poller=None):
+        self.tracker = tracker if tracker is not None else conversationTracker()
+        self.poller = poller if poller is not None else adaptivePoller()
+        self.__url = "/".join((weiboApiUrl, "list?uid={}&count={}&unfollowing=0".format(
+            self.tracker.botId, self.tracker.listCount)))
+        self.__waiting = {}
+        self.__changed = locks.Event()
+        self.__task = None
+        self.__polls = counter("weibo_inbox_polls_total",
+                               "Weibo list requests sent by the shared inbox poller.")
+        self.__waitingGauge = gauge(
+            "weibo_inbox_waiting_chats", "Chats waiting for a weibo reply.")
+
+    async def wait(self, request):
+        offsets = self.poller.pollOffsets()
+        future = asyncio.get_event_loop().create_future()
+        self.__waiting[request] = [future, offsets,
+                                   request.sendTimestamp + next(offsets)]
+        self.__waitingGauge.set(len(self.__waiting))
+        if self.__task is None or self.__task.done():
+            self.__task = asyncio.ensure_future(self.__run())
+        else:
+            self.__changed.set()
+        try:
+            await future
+        finally:
+            self.tracker.unregister(request)
+        self.poller.record(request)
+
+    async def __run(self):
+        while self.__waiting:
+            delay = min(entry[2] for entry in self.__waiting.values()) - time.time()
+            if delay > 0:
+                self.__changed.clear()
+                try:
+                    await self.__changed.wait(timedelta(seconds=delay))
+                    continue
+                except TimeoutError:
+                    pass
+            await self.__tick()
+        self.__waitingGauge.set(0)
+
+    async def __tick(self):
+        breaker = getBreaker(self.__url)
+        if breaker.allow():
+            self.__polls.inc()
+            try:
+                response = await httpClient.get(self.__url, priority=priorityChat, headers=weiboHeaders)
+                responseDict = await response.json()
+                self.tracker.feed(responseDict["data"]["msgs"])
+            except Exception as e:
+                breaker.recordFailure()
+                generalLogger.warning(
+                    "Weibo inbox poll failed, will retry later, here is the error message:\n{}".format(e))
+            else:
+                breaker.recordSuccess()
+        now = time.time()
+        for request, entry in list(self.__waiting.items()):
+            future, offsets, nextPollTime = entry
+            request.pollCount += 1
+            if request.ambiguous:
+                future.set_result(None)
+            elif request.replies:
+                quietUntil = request.lastReplySeen + self.poller.quietPeriod
+                if now >= quietUntil or now >= request.sendTimestamp + self.poller.timeout:
+                    future.set_result(None)
+                else:
+                    entry[2] = quietUntil
+            elif nextPollTime <= now:
+                offset = next(offsets, None)
+                if offset is not None:
+                    entry[2] = max(request.sendTimestamp + offset, now)
+                else:
+                    future.set_result(None)
+            if future.done():
+                del self.__waiting[request]
+        self.__waitingGauge.set(len(self.__waiting))
+
+
+defaultFirstPoll = 1.5
@@ -5,11 +5,13 @@ from socket import htonl, ntohl
 from Crypto.Random import get_random_bytes
 from Crypto.Cipher import AES
 from datetime import datetime, timedelta
-from xml.etree.cElementTree import fromstring
+from tornado.ioloop import IOLoop
+from concurrent.futures import ThreadPoolExecutor
 
 
 from configs import config, passiveResponsePacket, blockSize
 from log import generalLogger
+from decoder import extractEncrypt
 
 
 def verifyUrl(msgSignature, timestamp, nonce, echoString):
@@ -36,10 +38,38 @@ def encryptMsg(replyMsg, nonce, timestamp=None):
     return passiveResponsePacket.format(encrypt, signature, timestamp, nonce)
 
 
+async def encryptMsgAsync(replyMsg, nonce, timestamp=None):
+    if __useExecutor(len(replyMsg) * 3):
+        return await IOLoop.current().run_in_executor(__getExecutor(), encryptMsg, replyMsg, nonce, timestamp)
+    return encryptMsg(replyMsg, nonce, timestamp)
+
+
+async def decryptMsgAsync(postData, msgSignature, timestamp, nonce):
+    if postData is not None and __useExecutor(len(postData)):
+        return await IOLoop.current().run_in_executor(__getExecutor(), decryptMsg, postData, msgSignature, timestamp, nonce)
+    return decryptMsg(postData, msgSignature, timestamp, nonce)
+
+
+def newCipher():
+    return AES.new(AESKey, AES.MODE_CBC, AESIv)
+
+
+def __useExecutor(payloadSize):
+    return config["cryptExecutorWorkers"] > 0 and payloadSize >= config["cryptExecutorThreshold"]
+
+
+def __getExecutor():
+    global cryptExecutor
+    if cryptExecutor is None:
+        cryptExecutor = ThreadPoolExecutor(
+            max_workers=config["cryptExecutorWorkers"], thread_name_prefix="crypt")
+    return cryptExecutor
+
+
 def decryptMsg(postData, msgSignature, timestamp, nonce):
     if not all([postData, msgSignature, timestamp, nonce]):
         return
-    encrypt = __extract(postData)
+    encrypt = extractEncrypt(postData)
     if encrypt is None:
         return
     signature = __getSignature(config["cryptToken"], timestamp, nonce, encrypt)
@@ -59,16 +89,6 @@ def __getSignature(token, timestamp, nonce, msgEncrypt):
             "Get signature error, here is the error message:\n{}".format(e))
 
 
-def __extract(xmlText):
-    try:
-        xmlTree = fromstring(xmlText)
-        encrypt = xmlTree.find("Encrypt")
-        return encrypt.text
-    except Exception as e:
-        generalLogger.warning(
-            "Parse xml error, here is the error message:\n{}".format(e))
-
-
 def __encrypt(msg, receiveId):
     msg = msg.encode("utf-8")
     msg = get_random_bytes(16) + pack("I", htonl(len(msg))
@@ -77,7 +97,7 @@ def __encrypt(msg, receiveId):
     pad = chr(amountToPad)
     msg = msg + (pad * amountToPad).encode("utf-8")
     try:
-        msgEncrypt = cryptor.encrypt(msg)
+        msgEncrypt = newCipher().encrypt(msg)
         return base64.b64encode(msgEncrypt)
     except Exception as e:
         generalLogger.warning(
@@ -86,7 +106,7 @@ def __encrypt(msg, receiveId):
 
 def __decrypt(msgEncrypt, receiveId):
     try:
-        msgEncrypt = cryptor.decrypt(base64.b64decode(msgEncrypt))
+        msgEncrypt = newCipher().decrypt(base64.b64decode(msgEncrypt))
     except Exception as e:
         generalLogger.warning(
             "Decryption error, here is the error message:\n{}".format(e))
@@ -108,4 +128,5 @@ def __decrypt(msgEncrypt, receiveId):
 
 
 AESKey = base64.b64decode(config["cryptKey"] + "=")
-cryptor = AES.new(AESKey, AES.MODE_CBC, AESKey[:16])
+AESIv = AESKey[:16]
+cryptExecutor = None
@@ -0,0 +1,101 @@
+from xml.etree.cElementTree import fromstring
+
+
+from log import generalLogger
+
+
+class unusualPayloadError(Exception):
+    pass
+
+
+def scanField(data, tag, required=False, position=0):
+    openTag = b"<" + tag + b">"
+    start = data.find(openTag, position)
+    if start == -1:
+        if required or data.find(openTag) != -1:
+            raise unusualPayloadError(tag)
+        return None, position
+    start += len(openTag)
+    if data.startswith(cdataOpen, start):
+        end = data.find(b"]]></" + tag + b">", start)
+        if end == -1:
+            raise unusualPayloadError(tag)
+        value = data[start + len(cdataOpen):end]
+        if b"]]>" in value:
+            raise unusualPayloadError(tag)
+        end += 3
+    else:
+        end = data.find(b"</" + tag + b">", start)
+        if end == -1:
+            raise unusualPayloadError(tag)
+        value = data[start:end]
+        if b"<" in value or b"&" in value:
+            raise unusualPayloadError(tag)
+    return value.decode("utf-8"), end + len(tag) + 3
+
+
+def scanFields(data, fields):
+    values = []
+    position = 0
+    for tag, required in fields:
+        value, position = scanField(data, tag, required, position)
+        values.append(value)
+    return values
+
+
+class callbackMessage():
+    __slots__ = ("toId", "fromId", "createTime",
+                 "messageType", "content", "msgId", "agentId")
+
+    def __init__(self, toId=None, fromId=None, createTime=None, messageType=None, content=None, msgId=None, agentId=None):
+        self.toId = toId
+        self.fromId = fromId
+        self.createTime = createTime
+        self.messageType = messageType
+        self.content = content
+        self.msgId = msgId
+        self.agentId = agentId
+
+    def __str__(self):
+        return "{} message {} from {}".format(self.messageType, self.dedupKey, self.fromId)
+
+    @property
+    def dedupKey(self):
+        return self.msgId if self.msgId else (self.fromId, self.createTime)
+
+
+def extractEncrypt(postData):
+    if isinstance(postData, str):
+        postData = postData.encode("utf-8")
+    try:
+        return scanField(postData, b"Encrypt", True)[0]
+    except unusualPayloadError:
+        pass
+    try:
+        return fromstring(postData).find("Encrypt").text
+    except Exception as e:
+        generalLogger.warning(
+            "Parse xml error, here is the error message:\n{}".format(e))
+
+
+def decodeMessage(xmlText):
+    try:
+        return callbackMessage(*scanFields(xmlText, messageFields))
+    except unusualPayloadError as e:
+        generalLogger.debug(
+            "Field {} needs a full xml parse, falling back to ElementTree.".format(e))
+    try:
+        xmlTree = fromstring(xmlText)
+    except Exception as e:
+        generalLogger.warning(
+            "Parse xml error, here is the error message:\n{}".format(e))
+        return
+    if xmlTree.find("FromUserName") is None or xmlTree.find("MsgType") is None:
+        generalLogger.warning("Callback message misses required fields.")
+        return
+    return callbackMessage(*[xmlTree.findtext(tag.decode("utf-8")) for tag, _ in messageFields])
+
+
+cdataOpen = b"<![CDATA["
+messageFields = ((b"ToUserName", False), (b"FromUserName", True), (b"CreateTime", False), (b"MsgType", True),
+                 (b"Content", False), (b"MsgId", False), (b"AgentID", False))
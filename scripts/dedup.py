@@ -0,0 +1,92 @@
+import time
+import aiosqlite
+from collections import OrderedDict
+
+
+from configs import config, dedupTableStructure
+from metrics import counter, gauge
+
+
+class ttlCache():
+    def __init__(self, name, maxSize=None, ttl=None):
+        self.maxSize = maxSize if maxSize is not None else config["dedupCacheSize"]
+        self.ttl = ttl if ttl is not None else config["dedupCacheTtl"]
+        self.__entries = OrderedDict()
+        self.__hits = counter("dedup_cache_hits_total",
+                              "Lookups that found a key still in the cache.", cache=name)
+        self.__misses = counter("dedup_cache_misses_total",
+                                "Lookups that did not find the key in the cache.", cache=name)
+        self.__size = gauge("dedup_cache_size",
+                            "Keys currently held by the cache.", cache=name)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __evictExpired(self, now):
+        while self.__entries:
+            key, expireTime = next(iter(self.__entries.items()))
+            if expireTime > now:
+                break
+            del self.__entries[key]
+
+    async def forget(self, key):
+        self.__entries.pop(key, None)
+        self.__size.set(len(self.__entries))
+
+    async def seen(self, key):
+        now = time.monotonic()
+        self.__evictExpired(now)
+        expireTime = self.__entries.get(key)
+        if expireTime is not None and expireTime > now:
+            self.__entries.move_to_end(key)
+            self.__hits.inc()
+            return True
+        self.__misses.inc()
+        self.__entries.pop(key, None)
+        self.__entries[key] = now + self.ttl
+        if len(self.__entries) > self.maxSize:
+            self.__entries.popitem(last=False)
+        self.__size.set(len(self.__entries))
+        return False
+
+
+class sharedTtlCache():
+    def __init__(self, name, dataBaseFilePath, tableName, ttl=None, purgeInterval=256):
+        self.tableName = tableName
+        self.ttl = ttl if ttl is not None else config["dedupCacheTtl"]
+        self.purgeInterval = purgeInterval
+        self.__dataBaseFilePath = dataBaseFilePath
+        self.__dataBase = None
+        self.__lookups = 0
+        self.__hits = counter("dedup_cache_hits_total",
+                              "Lookups that found a key still in the cache.", cache=name)
+        self.__misses = counter("dedup_cache_misses_total",
+                                "Lookups that did not find the key in the cache.", cache=name)
+
+    async def open(self):
+        self.__dataBase = await aiosqlite.connect(self.__dataBaseFilePath, isolation_level=None)
+        await self.__dataBase.execute("pragma journal_mode=wal")
+        await self.__dataBase.execute("pragma synchronous=normal")
+        await self.__dataBase.execute("create table if not exists {} ({})".format(self.tableName, dedupTableStructure))
+
+    async def close(self):
+        if self.__dataBase is not None:
+            await self.__dataBase.close()
+            self.__dataBase = None
+
+    async def forget(self, key):
+        await self.__dataBase.execute("delete from {} where key = ?".format(self.tableName), (repr(key),))
+
+    async def seen(self, key):
+        now = time.time()
+        self.__lookups += 1
+        if self.__lookups % self.purgeInterval == 0:
+            await self.__dataBase.execute("delete from {} where expireTime <= ?".format(self.tableName), (now,))
+        async with self.__dataBase.execute("insert into {} values (?, ?) on conflict(key) do update set expireTime = excluded.expireTime where expireTime <= ?".format(
+                self.tableName), (repr(key), now + self.ttl, now)) as cursor:
+            inserted = cursor.rowcount
+        if inserted == 0:
+            self.__hits.inc()
+            return True
+        self.__misses.inc()
+        return False
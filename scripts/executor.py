@@ -0,0 +1,145 @@
+import time
+import asyncio
+import multiprocessing
+from functools import partial
+from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from abc import ABCMeta, abstractmethod
+
+
+from configs import config
+from log import schedulerLogger
+from metrics import counter, histogram
+
+
+def createExecutor(executorName):
+    if executorName == "asyncio":
+        return asyncioExecutor()
+    elif executorName == "thread":
+        return threadPoolExecutor(config["schedulerThreadWorkers"])
+    elif executorName == "process":
+        return processPoolExecutor(config["schedulerProcessWorkers"])
+    else:
+        schedulerLogger.error(
+            "Unsupported executor type {}".format(executorName))
+        raise TypeError("Unsupported executor type {}".format(executorName))
+
+
+def timedCall(func, args, kwargs):
+    startTimestamp = time.time()
+    try:
+        func(*args, **kwargs)
+    except Exception as e:
+        return startTimestamp, time.time() - startTimestamp, e
+    return startTimestamp, time.time() - startTimestamp, None
+
+
+async def timedCoroutine(func, args, kwargs):
+    startTimestamp = time.time()
+    try:
+        await func(*args, **kwargs)
+    except Exception as e:
+        return startTimestamp, time.time() - startTimestamp, e
+    return startTimestamp, time.time() - startTimestamp, None
+
+
+class baseExecutor(metaclass=ABCMeta):
+    def __init__(self, name):
+        self.name = name
+        self.instances = defaultdict(lambda: 0)
+        self.startLag = histogram("scheduler_job_start_lag_seconds",
+                                  "Delay between the scheduled run time of a job and the start of the run.", executor=name)
+        self.duration = histogram("scheduler_job_duration_seconds",
+                                  "Time a job run took to finish.", executor=name)
+        self.skipped = counter("scheduler_skipped_instances_total",
+                               "Job runs skipped because the job reached maxInstances.", executor=name)
+        self.missed = counter("scheduler_missed_runs_total",
+                              "Job runs dropped because they were later than misfireGraceTime.", executor=name)
+
+    def isFull(self, job):
+        return self.instances[job.state["id"]] >= job.state["maxInstances"]
+
+    def submit(self, job, runTimes):
+        jobId = job.state["id"]
+
+        def observeRun(runTime, future):
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                schedulerLogger.warning("Job '{}' could not run on executor '{}', here is the error message:\n{}".format(
+                    job, self.name, future.exception()))
+                return
+            startTimestamp, duration, error = future.result()
+            self.startLag.observe(
+                (datetime.utcfromtimestamp(startTimestamp) - runTime).total_seconds())
+            self.duration.observe(duration)
+            if error is not None:
+                schedulerLogger.warning("Job '{}' raised an exception on executor '{}', here is the error message:\n{}".format(
+                    job, self.name, error))
+
+        def callback(future):
+            self.instances[jobId] -= 1
+            if self.instances[jobId] == 0:
+                del self.instances[jobId]
+        runs = []
+        for runTime in runTimes:
+            run = asyncio.ensure_future(self.run(job))
+            run.add_done_callback(partial(observeRun, runTime))
+            runs.append(run)
+        futures = asyncio.gather(*runs, return_exceptions=True)
+        futures.add_done_callback(callback)
+        self.instances[jobId] += 1
+        return futures
+
+    def shutdown(self):
+        pass
+
+    @abstractmethod
+    def run(self, job):
+        pass
+
+
+class asyncioExecutor(baseExecutor):
+    def __init__(self):
+        super().__init__("asyncio")
+
+    def run(self, job):
+        return timedCoroutine(job.state["func"], job.state["args"], job.state["kwargs"])
+
+
+class poolExecutor(baseExecutor):
+    def __init__(self, name, workers):
+        super().__init__(name)
+        self.workers = workers
+        self.__pool = None
+
+    def run(self, job):
+        if self.__pool is None:
+            self.__pool = self.createPool()
+        return asyncio.get_event_loop().run_in_executor(self.__pool, timedCall, job.state["func"], job.state["args"], job.state["kwargs"])
+
+    def shutdown(self):
+        if self.__pool is not None:
+            self.__pool.shutdown(wait=False)
+            self.__pool = None
+
+    @abstractmethod
+    def createPool(self):
+        pass
+
+
+class threadPoolExecutor(poolExecutor):
+    def __init__(self, workers):
+        super().__init__("thread", workers)
+
+    def createPool(self):
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler")
+
+
+class processPoolExecutor(poolExecutor):
+    def __init__(self, workers):
+        super().__init__("process", workers)
+
+    def createPool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"))
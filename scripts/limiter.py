@@ -0,0 +1,78 @@
+import time
+import heapq
+import asyncio
+from itertools import count
+
+
+from configs import priorityScheduled
+from log import generalLogger
+from metrics import gauge, histogram
+
+
+class tokenBucket():
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__updated = time.monotonic()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.burst, self.__tokens +
+                            (now - self.__updated) * self.rate)
+        self.__updated = now
+
+    def delay(self):
+        self.__refill()
+        if self.__tokens >= 1:
+            return 0
+        return (1 - self.__tokens) / self.rate
+
+    def take(self):
+        if self.delay() > 0:
+            return False
+        self.__tokens -= 1
+        return True
+
+
+class rateLimiter():
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.__bucket = tokenBucket(rate, burst)
+        self.__queue = []
+        self.__sequence = count()
+        self.__dispatcher = None
+        self.__depth = gauge("outbound_queue_depth",
+                             "Outbound requests waiting for the rate limiter.", api=name)
+        self.__waitTime = histogram("outbound_queue_wait_seconds",
+                                    "Time outbound requests waited for the rate limiter.", api=name)
+
+    async def acquire(self, priority=priorityScheduled):
+        if not self.__queue and self.__bucket.take():
+            self.__waitTime.observe(0)
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.__queue, (priority, next(
+            self.__sequence), time.monotonic(), future))
+        self.__depth.set(len(self.__queue))
+        if self.__dispatcher is None or self.__dispatcher.done():
+            self.__dispatcher = asyncio.ensure_future(self.__dispatch())
+        await future
+
+    async def __dispatch(self):
+        while self.__queue:
+            delay = self.__bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            priority, _, enqueueTime, future = heapq.heappop(self.__queue)
+            self.__depth.set(len(self.__queue))
+            if future.done():
+                continue
+            self.__bucket.take()
+            waitTime = time.monotonic() - enqueueTime
+            self.__waitTime.observe(waitTime)
+            if waitTime > 1:
+                generalLogger.debug("Request to {} with priority {} waited {:.2f}s for the rate limiter.".format(
+                    self.name, priority, waitTime))
+            future.set_result(None)
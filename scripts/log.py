@@ -8,7 +8,7 @@ from aiosqlite.core import LOG
 from configs import config, logConfigDict, logFilesDir
 
 
-def loadLogConfig():
+def loadLogConfig(workerIndex=0):
     if config["logEnable"]:
         nameArray = ["access", "application", "general", "sqlite", "scheduler"]
         loggerNameArray = ["tornado.access", "tornado.application",
@@ -28,7 +28,7 @@ def loadLogConfig():
             handlerDict = logConfigDict["handlers"][name + "Handler"]
             handlerDict["level"] = logLevel
             handlerDict["filename"] = os.path.join(
-                logFilesDir, name + "Log", name + ".log")
+                logFilesDir, name + "Log", name + (".{}".format(workerIndex) if workerIndex else "") + ".log")
             handlerDict["backupCount"] = config["logBackupCount"]
         if config["logRotateMode"] == "time":
             for name in nameArray:
@@ -1,16 +1,28 @@
 import pickle
 import os
+import sys
 import asyncio
 import signal
-from tornado.options import options
+import subprocess
+from tornado.options import options, define
 from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
 
 
 from configs import config, globalState, dataBaseDir, cacheFilePath, cacheTableStructure, setValue, starting, running, stopping
 from log import loadLogConfig, generalLogger
 from dataBase import syncDataBase
 from scheduler import taskScheduler
-from server import getConnectionCount, httpServer
+from client import httpClient, defaultHosts
+from outbox import outbox
+from messager import chat, sendPendingWechatMessages
+from wechatToken import tokenManager
+from server import getConnectionCount, httpServer, callbackWorkQueue, callbackCache
+from cluster import getWorkerCount, leader, relay
+
+
+define("workerIndex", default=0, type=int,
+       help="index of this worker process, 0 starts the other workers")
 
 
 def main():
@@ -22,13 +34,19 @@ def main():
 
 
 def start():
+    legacyWechatMessages = []
     options.parse_command_line()
-    loadLogConfig()
+    loadLogConfig(options.workerIndex)
     if not os.path.exists(dataBaseDir):
         os.mkdir(dataBaseDir)
+    leader.elect()
     with syncDataBase(cacheFilePath) as dataBase:
         tableNames = dataBase.tableNames()
-        if config["cacheTableName"] not in tableNames:
+        if not leader.isLeader:
+            for key, value in dataBase.queryTable("*", config["cacheTableName"]):
+                if key in globalState:
+                    setValue(key, pickle.loads(value))
+        elif config["cacheTableName"] not in tableNames:
             dataBase.createTable(config["cacheTableName"], cacheTableStructure)
             for key in globalState:
                 dataBase.insertRow(config["cacheTableName"], key, pickle.dumps(
@@ -38,30 +56,80 @@ def start():
         else:
             cacheList = dataBase.queryTable("*", config["cacheTableName"])
             for key, value in cacheList:
-                if key != "pendingJobs":
-                    setValue(key, pickle.loads(value))
-                else:
+                if key == "pendingJobs":
                     taskScheduler.addPendingJobs(pickle.loads(value))
-    taskScheduler.start()
-    httpServer.listen(config["botListenPort"])
+                elif key == "pendingWechatMessages":
+                    legacyWechatMessages = pickle.loads(value)
+                    dataBase.deleteRows(
+                        config["cacheTableName"], "where key = 'pendingWechatMessages'")
+                else:
+                    setValue(key, pickle.loads(value))
+    IOLoop.current().run_sync(lambda: httpClient.start(*defaultHosts))
+    IOLoop.current().run_sync(lambda: outbox.open(leader.isLeader))
+    for postDict in legacyWechatMessages:
+        IOLoop.current().run_sync(lambda: outbox.put(postDict))
+    if getWorkerCount() > 1:
+        IOLoop.current().run_sync(relay.open)
+        IOLoop.current().run_sync(callbackCache.open)
+    if leader.isLeader:
+        IOLoop.current().run_sync(startLeaderDuties)
+    else:
+        leader.start(takeOverLeaderDuties)
+    callbackWorkQueue.start()
+    httpServer.add_sockets(bind_sockets(
+        config["botListenPort"], reuse_port=getWorkerCount() > 1))
     httpServer.start()
+    IOLoop.current().add_callback(sendPendingWechatMessages)
+    if options.workerIndex == 0:
+        for workerIndex in range(1, getWorkerCount()):
+            workers.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ["--workerIndex={}".format(workerIndex)],
+                                            start_new_session=True))
     generalLogger.info("wechatBot start successfully!")
 
 
+async def startLeaderDuties():
+    await taskScheduler.start()
+    if getWorkerCount() > 1:
+        relay.start(lambda fromId, content: callbackWorkQueue.submit(
+            chat, fromId, content=content))
+        await taskScheduler.addJob("sendPendingWechatMessages", sendPendingWechatMessages, description="Drain wechat messages saved by other workers",
+                                   triggerName="interval", seconds=config["outboxDrainInterval"], replaceExisting=True)
+
+
+async def takeOverLeaderDuties():
+    await tokenManager.reload()
+    await outbox.recover()
+    await startLeaderDuties()
+    IOLoop.current().add_callback(sendPendingWechatMessages)
+
+
 async def close():
     httpServer.stop()
+    await leader.stop()
+    await relay.stop()
     while getConnectionCount() != 0:
         await asyncio.sleep(1)
     await httpServer.close_all_connections()
-    await taskScheduler.shutdown()
+    await callbackWorkQueue.close()
+    if leader.isLeader:
+        await taskScheduler.shutdown()
     while len(asyncio.all_tasks()) != 1:
         await asyncio.sleep(1)
-    with syncDataBase(cacheFilePath) as dataBase:
-        for key in globalState:
-            dataBase.updateCol(config["cacheTableName"], "where key = '{}'".format(
-                key), value=pickle.dumps(globalState[key], pickle.HIGHEST_PROTOCOL))
-        dataBase.updateCol(config["cacheTableName"], "where key = 'pendingJobs'", value=pickle.dumps(
-            taskScheduler.getPendingJobs(), pickle.HIGHEST_PROTOCOL))
+    await httpClient.close()
+    await outbox.close()
+    await relay.close()
+    if getWorkerCount() > 1:
+        await callbackCache.close()
+    if leader.isLeader:
+        with syncDataBase(cacheFilePath) as dataBase:
+            for key in globalState:
+                dataBase.updateCol(config["cacheTableName"], "where key = '{}'".format(
+                    key), value=pickle.dumps(globalState[key], pickle.HIGHEST_PROTOCOL))
+            dataBase.updateCol(config["cacheTableName"], "where key = 'pendingJobs'", value=pickle.dumps(
+                taskScheduler.getPendingJobs(), pickle.HIGHEST_PROTOCOL))
+        leader.release()
+    while any(worker.poll() is None for worker in workers):
+        await asyncio.sleep(1)
     ioLoop.stop()
 
 
@@ -76,11 +144,14 @@ def exitHandler(signum, frame):
     else:
         print("程序准备退出")
         state = stopping
+        for worker in workers:
+            worker.send_signal(signal.SIGINT)
         ioLoop.add_callback_from_signal(close)
 
 
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, exitHandler)
     state = None
+    workers = []
     ioLoop = IOLoop.current()
     main()
\ No newline at end of file
@@ -1,56 +1,85 @@
 import asyncio
-import aiohttp
 from tornado import locks
-from datetime import datetime, timedelta
 
 
-from configs import config, getValue, setValue, qywxApiUrl, weiboApiUrl, weiboHeaders
+from configs import config, getValue, setValue, qywxApiUrl, weiboApiUrl, weiboHeaders, weiboBotId, priorityChat, priorityScheduled, priorityPending
 from log import generalLogger
-from scheduler import taskScheduler
+from client import httpClient
+from conversation import chatRequest, inboxPoller
+from batcher import messageBatcher
+from retry import retryPolicy, retryableError, circuitOpenError, retryExhaustedError, getBreaker
+from wechatToken import tokenManager
+from outbox import outbox, notAttempted
+from cluster import leader, relay
 
 
 def urljoin(base, *options):
     return "/".join((base,) + options)
 
 
-async def chat(fromId, token=None, messageType="text", **args):
+async def chat(fromId, token=None, messageType="text", passiveReply=None, **args):
+    if not leader.isLeader:
+        if passiveReply is not None and not passiveReply.done():
+            passiveReply.set_result(None)
+        await relay.forward(fromId, args.get("content"))
+        return
     if token is None:
         token = getValue("weiboToken")
     postDict = __getWeiboPostDict(messageType, **args)
-    async with __chatLock:
-        sendTimestamp = datetime.utcnow().timestamp()
-        sendFlag = await __sendWeiboMessage(token, postDict)
-        if sendFlag:
-            responseMessages = await __getWeiboMessage(sendTimestamp)
-        else:
-            responseMessages = ["消息发送失败，请稍后重试~"]
-    for index, message in enumerate(responseMessages):
-        sendFlag = await sendWechatMessage(content=message, touser=fromId)
-        if not sendFlag:
-            generalLogger.warning("Network error, ignore the remaining {} message(s).".format(
-                len(responseMessages)-index))
+    async with __chatSemaphore:
+        request = chatRequest(fromId, args.get("content"))
+        async with __weiboSendLock:
+            inbox.tracker.register(request)
+            sendFlag = False
+            try:
+                sendFlag = await __sendWeiboMessage(token, postDict)
+            finally:
+                if not sendFlag:
+                    inbox.tracker.unregister(request)
+            if sendFlag:
+                responseMessages = await __getWeiboMessage(request)
+            else:
+                responseMessages = ["消息发送失败，请稍后重试~"]
+    if passiveReply is not None and not passiveReply.done():
+        if len(responseMessages) == 1:
+            passiveReply.set_result(responseMessages[0])
+            generalLogger.debug("Answered {} passively.".format(fromId))
             return
+        passiveReply.set_result(None)
+    sendFlags = await asyncio.gather(*[deliverWechatMessage(message, touser=fromId, priority=priorityChat) for message in responseMessages])
+    if not all(sendFlags):
+        generalLogger.warning("Network error, {} of {} message(s) failed to send.".format(
+            sendFlags.count(False), len(responseMessages)))
+        return
     generalLogger.debug(
         "Send {} message(s) successfully!".format(len(responseMessages)))
 
 
-async def sendWechatMessage(token=None, messageType="text", tokenInvalidSaved=False, **args):
+async def deliverWechatMessage(content, touser=None, toparty=None, priority=priorityScheduled):
+    return await __batcher.submit(content, touser=touser, toparty=toparty, priority=priority)
+
+
+async def broadcastWechatMessage(content, priority=priorityScheduled):
+    return await __batcher.submit(content, toparty=config["departmentId"], priority=priority)
+
+
+async def sendWechatMessage(token=None, messageType="text", tokenInvalidSaved=False, priority=priorityScheduled, **args):
     if token is None:
-        token = getValue("wechatToken")
+        token = await tokenManager.getToken()
     if not (tokenInvalidSaved or getValue("wechatTokenAvailable")):
         generalLogger.info(
             "WechatToken cannot be gotten and tokenInvalidSaved is false, so ignoring this wechat message.")
         return False
     postDict = __getWechatPostDict(messageType, **args)
     if not getValue("wechatTokenAvailable"):
-        __saveWechatMessage(postDict)
+        await __saveWechatMessage(postDict)
         return False
-    return await __sendWechatMessage(token, postDict, tokenInvalidSaved)
+    return await __sendWechatMessage(token, postDict, tokenInvalidSaved, priority)
 
 
 def __getWeiboPostDict(messageType, **args):
     postDict = {
-        "uid": 5175429989,
+        "uid": weiboBotId,
         "st": getValue("weiboToken")
     }
     if messageType == "text":
@@ -70,248 +99,144 @@ def __getWechatPostDict(messageType, **args):
     return postDict
 
 
-def __saveWechatMessage(postDict):
-    pendingWechatMessages = getValue("pendingWechatMessages")
-    if len(pendingWechatMessages) >= config["maxPendingWechatMessages"]:
+async def __saveWechatMessage(postDict):
+    try:
+        await outbox.put(postDict)
+    except Exception as e:
         generalLogger.warning(
-            "MaxPendingWechatMessages has been reached, ignoring this wechat message.")
-    else:
-        generalLogger.info(
-            "WechatToken cannot be gotten temporarily, saved this wechat message until the token can be gotten.")
-        pendingWechatMessages.append(postDict)
+            "Unable to save this wechat message, here is the error message:\n{}".format(e))
 
 
 async def __sendWeiboMessage(token, postDict):
+    try:
+        return await __retryPolicy.call(getBreaker(weiboApiUrl), __postWeiboMessage, token, postDict)
+    except circuitOpenError:
+        generalLogger.warning(
+            "Weibo api circuit is open, ignoring this weibo message.")
+    except retryExhaustedError as e:
+        generalLogger.warning(
+            "MaxTryCount has been reached, ignoring this weibo message, here is the last error message:\n{}".format(e))
+    return False
+
+
+async def __postWeiboMessage(token, postDict):
     getUrl = urljoin(weiboApiUrl, "send")
-    tryCount = 0
-    sendFlag = False
-    async with aiohttp.ClientSession() as session:
-        while tryCount < config["maxTryCount"]:
-            errorType = 0
-            try:
-                response = await session.post(getUrl, headers=weiboHeaders, data=postDict)
-            except Exception as e:
-                errorMessage = "Network connection error, will retry in two seconds, here is the error message:\n{}".format(
-                    e)
-                errorType = 1
-            else:
-                responseDict = await response.json()
-                if responseDict["ok"] == 1:
-                    generalLogger.info("This weibo message has been sent!")
-                    sendFlag = True
-                elif responseDict["errno"] == "100006":
-                    await __getWeiboToken()
-                    if getValue("weiboToken") == token:
-                        generalLogger.info(
-                            "WeiboToken cannot be gotten, ignoring this weibo message.")
-                    else:
-                        generalLogger.info(
-                            "Retry sending the message with the new token.")
-                        errorType = 2
-                else:
-                    generalLogger.warning(
-                        "An unresolved error occurred, here is the error number: {}".format(responseDict["errno"]))
-            finally:
-                tryCount += 1
-                if errorType == 0:
-                    break
-                elif errorType == 1:
-                    if tryCount != config["maxTryCount"]:
-                        generalLogger.warning(errorMessage)
-                        await asyncio.sleep(2)
-                    else:
-                        generalLogger.warning(
-                            "MaxTryCount has been reached, ignoring this weibo message.")
-                else:
-                    tryCount -= 1
-    return sendFlag
-
-
-async def __sendWechatMessage(token, postDict, tokenInvalidSaved):
+    response = await httpClient.post(getUrl, priority=priorityChat, headers=weiboHeaders, data=postDict)
+    responseDict = await response.json()
+    if responseDict["ok"] == 1:
+        generalLogger.info("This weibo message has been sent!")
+        return True
+    elif responseDict["errno"] == "100006":
+        await __getWeiboToken()
+        if getValue("weiboToken") == token:
+            generalLogger.info(
+                "WeiboToken cannot be gotten, ignoring this weibo message.")
+            return False
+        generalLogger.info("Retry sending the message with the new token.")
+        postDict["st"] = getValue("weiboToken")
+        return await __postWeiboMessage(getValue("weiboToken"), postDict)
+    generalLogger.warning(
+        "An unresolved error occurred, here is the error number: {}".format(responseDict["errno"]))
+    return False
+
+
+async def __sendWechatMessage(token, postDict, tokenInvalidSaved, priority=priorityScheduled, fromOutbox=False):
+    try:
+        return await __retryPolicy.call(getBreaker(qywxApiUrl), __postWechatMessage, token, postDict, tokenInvalidSaved, priority)
+    except circuitOpenError:
+        if fromOutbox:
+            return notAttempted
+        generalLogger.warning(
+            "Wechat api circuit is open, saved this wechat message until it recovers.")
+        await __saveWechatMessage(postDict)
+    except retryExhaustedError as e:
+        generalLogger.warning(
+            "MaxTryCount has been reached, ignoring this wechat message, here is the last error message:\n{}".format(e))
+    return False
+
+
+async def __postWechatMessage(token, postDict, tokenInvalidSaved, priority, tokenRefreshed=False):
     getUrl = urljoin(qywxApiUrl, "message", "send?access_token={}")
-    tryCount = 0
-    sendFlag = False
-    async with aiohttp.ClientSession() as session:
-        while tryCount < config["maxTryCount"]:
-            errorType = 0
-            try:
-                response = await session.post(getUrl.format(token), json=postDict)
-            except Exception as e:
-                errorMessage = "Network connection error, will retry in two seconds, here is the error message:\n{}".format(
-                    e)
-                errorType = 1
-            else:
-                responseDict = await response.json()
-                if responseDict["errcode"] == 0:
-                    generalLogger.info("This wechat message has been sent!")
-                    sendFlag = True
-                elif responseDict["errcode"] == -1:
-                    errorMessage = "Wechat api system busy, will retry in two seconds."
-                    errorType = 1
-                elif responseDict["errcode"] == 40014:
-                    retry = False
-                    async with __getWechatTokenLock:
-                        if getValue("wechatTokenAvailable"):
-                            if token == getValue("wechatToken"):
-                                await __getWechatToken()
-                                retry = getValue("wechatTokenAvailable")
-                            else:
-                                retry = True
-                    if retry:
-                        generalLogger.info(
-                            "Retry sending the message with the new token.")
-                        token = getValue("wechatToken")
-                        errorType = 2
-                    elif tokenInvalidSaved:
-                        __saveWechatMessage(postDict)
-                    else:
-                        generalLogger.info(
-                            "WechatToken cannot be gotten and tokenInvalidSaved is false, so ignoring this wechat message.")
-                else:
-                    generalLogger.warning("An unresolved error occurred, here is the error code: {}".format(
-                        responseDict["errcode"]))
-            finally:
-                tryCount += 1
-                if errorType == 0:
-                    break
-                elif errorType == 1:
-                    if tryCount != config["maxTryCount"]:
-                        generalLogger.warning(errorMessage)
-                        await asyncio.sleep(2)
-                    else:
-                        generalLogger.warning(
-                            "MaxTryCount has been reached, ignoring this wechat message.")
-                else:
-                    tryCount -= 1
-    return sendFlag
-
-
-async def __getWeiboMessage(sendTimestamp):
-    getUrl = urljoin(weiboApiUrl, "list?uid=5175429989&count=10&unfollowing=0")
-    tryCount = 0
+    response = await httpClient.post(getUrl.format(token), priority=priority, json=postDict)
+    responseDict = await response.json()
+    if responseDict["errcode"] == 0:
+        generalLogger.info("This wechat message has been sent!")
+        return True
+    elif responseDict["errcode"] == -1:
+        raise retryableError("Wechat api system busy.")
+    elif responseDict["errcode"] in (40014, 42001) and not tokenRefreshed:
+        newToken = None
+        if getValue("wechatTokenAvailable"):
+            generalLogger.info(
+                "WechatToken rejected, falling back to refreshing it.")
+            newToken = await tokenManager.refresh(token)
+        if newToken is not None:
+            generalLogger.info("Retry sending the message with the new token.")
+            return await __postWechatMessage(newToken, postDict, tokenInvalidSaved, priority, True)
+        elif tokenInvalidSaved:
+            await __saveWechatMessage(postDict)
+        else:
+            generalLogger.info(
+                "WechatToken cannot be gotten and tokenInvalidSaved is false, so ignoring this wechat message.")
+        return False
+    generalLogger.warning("An unresolved error occurred, here is the error code: {}".format(
+        responseDict["errcode"]))
+    return False
+
+
+async def __getWeiboMessage(request):
     responseMessages = []
-    await asyncio.sleep(1.5)
-    async with aiohttp.ClientSession() as session:
-        while tryCount < config["maxTryCount"]:
-            errorType = 0
-            try:
-                response = await session.get(getUrl, headers=weiboHeaders)
-            except Exception as e:
-                errorMessage = "Network connection error, will retry in one second, here is the error message:\n{}".format(
-                    e)
-                errorType = 1
-            else:
-                responseDict = await response.json()
-                for message in responseDict["data"]["msgs"]:
-                    receiveTimestamp = datetime.strptime(
-                        message["created_at"], "%a %b %d %H:%M:%S %z %Y").timestamp()
-                    if receiveTimestamp < sendTimestamp:
-                        break
-                    elif message["sender_id"] == 5175429989:
-                        if message["media_type"] == 0:
-                            responseMessages.append(message["text"])
-                        else:
-                            responseMessages.append("暂不支持显示非文本类消息哦~")
-                if responseMessages:
-                    generalLogger.info("Weibo message(s) gotten!")
-                else:
-                    errorMessage = "Weibo message(s) cannot be gotten temporarily, will retry in one second."
-                    errorType = 1
-            finally:
-                tryCount += 1
-                if errorType == 0:
-                    break
-                else:
-                    if tryCount != config["maxTryCount"]:
-                        generalLogger.warning(errorMessage)
-                        await asyncio.sleep(1)
-                    else:
-                        generalLogger.info(
-                            "MaxTryCount has been reached, weibo message(s) failed to get.")
-                        responseMessages.append("获取消息失败，请稍后重试~")
-    responseMessages.reverse()
+    await inbox.wait(request)
+    if request.ambiguous:
+        generalLogger.warning(
+            "Weibo message(s) cannot be matched to {} safely.".format(request))
+        responseMessages.append("获取消息失败，请稍后重试~")
+    elif request.replies:
+        generalLogger.info("Weibo message(s) gotten!")
+        responseMessages.extend(request.replies)
+    else:
+        generalLogger.info(
+            "ChatReplyTimeout has been reached, weibo message(s) failed to get.")
+        responseMessages.append("获取消息失败，请稍后重试~")
     return responseMessages
 
 
 async def __getWeiboToken():
-    getUrl = urljoin(weiboApiUrl, "list?uid=5175429989&count=10&unfollowing=0")
-    tryCount = 0
-    async with aiohttp.ClientSession() as session:
-        while tryCount < config["maxTryCount"]:
-            errorType = 0
-            try:
-                response = await session.get(getUrl, headers=weiboHeaders)
-            except Exception as e:
-                errorMessage = "Network connection error, will retry in two seconds, here is the error message:\n{}".format(
-                    e)
-                errorType = 1
-            else:
-                generalLogger.info("WeiboToken gotten!")
-                oldWeiboToken = getValue("weiboToken")
-                newWeiboToken = response.cookies["XSRF-TOKEN"].value
-                setValue("weiboToken", newWeiboToken)
-                weiboHeaders["X-XSRF-TOKEN"] = newWeiboToken
-                weiboHeaders["Cookie"] = weiboHeaders["Cookie"].replace(
-                    "XSRF-TOKEN=" + oldWeiboToken, "XSRF-TOKEN=" + newWeiboToken)
-            finally:
-                tryCount += 1
-                if errorType == 0:
-                    break
-                else:
-                    if tryCount != config["maxTryCount"]:
-                        generalLogger.warning(errorMessage)
-                        await asyncio.sleep(2)
-                    else:
-                        generalLogger.info(
-                            "MaxTryCount has been reached, weiboToken cannot be gotten.")
-
-
-async def __getWechatToken():
-    getUrlParameters = "gettoken?corpid={}&corpsecret={}".format(
-        config["corpId"], config["secret"])
-    getUrl = urljoin(qywxApiUrl, getUrlParameters)
-    tryCount = 0
-    async with aiohttp.ClientSession() as session:
-        while tryCount < config["maxTryCount"]:
-            errorType = 0
-            try:
-                response = await session.get(getUrl)
-            except Exception as e:
-                errorMessage = "Network connection error, will retry in two seconds, here is the error message:\n{}".format(
-                    e)
-                errorType = 1
-            else:
-                responseDict = await response.json()
-                if responseDict["errcode"] == 0:
-                    generalLogger.info("WechatToken gotten!")
-                    setValue("wechatToken", responseDict["access_token"])
-                    setValue("wechatTokenAvailable", True)
-                    pendingWechatMessages = getValue("pendingWechatMessages")
-                    if pendingWechatMessages:
-                        asyncio.gather(
-                            *[__sendWechatMessage(responseDict["access_token"], postDict, True) for postDict in pendingWechatMessages])
-                        setValue("pendingWechatMessages", [])
-                elif responseDict["errcode"] == -1:
-                    errorMessage = "Wechat api system busy, will retry in two seconds."
-                    errorType = 1
-                else:
-                    generalLogger.warning("An unresolved error occurred, here is the error code: {}".format(
-                        responseDict["errcode"]))
-                    setValue("wechatTokenAvailable", False)
-            finally:
-                tryCount += 1
-                if errorType == 0:
-                    break
-                else:
-                    setValue("wechatTokenAvailable", False)
-                    if tryCount != config["maxTryCount"]:
-                        generalLogger.warning(errorMessage)
-                        await asyncio.sleep(2)
-                    else:
-                        generalLogger.warning(
-                            "MaxTryCount has been reached, will retry getting wechatToken in five minutes.")
-                        await taskScheduler.addJob("getToken", __getWechatToken, description="Try to get token", triggerName="date", runDate=(datetime.utcnow() + timedelta(minutes=5)))
-
-
-__getWechatTokenLock = locks.Lock()
-__chatLock = locks.Lock()
+    try:
+        await __retryPolicy.call(getBreaker(weiboApiUrl), __fetchWeiboToken)
+    except (circuitOpenError, retryExhaustedError) as e:
+        generalLogger.info(
+            "WeiboToken cannot be gotten, here is the error message:\n{}".format(e))
+
+
+async def __fetchWeiboToken():
+    getUrl = urljoin(weiboApiUrl, "list?uid={}&count=10&unfollowing=0".format(weiboBotId))
+    response = await httpClient.get(getUrl, priority=priorityChat, headers=weiboHeaders)
+    oldWeiboToken = getValue("weiboToken")
+    newWeiboToken = response.cookies["XSRF-TOKEN"].value
+    generalLogger.info("WeiboToken gotten!")
+    setValue("weiboToken", newWeiboToken)
+    weiboHeaders["X-XSRF-TOKEN"] = newWeiboToken
+    weiboHeaders["Cookie"] = weiboHeaders["Cookie"].replace(
+        "XSRF-TOKEN=" + oldWeiboToken, "XSRF-TOKEN=" + newWeiboToken)
+
+
+async def sendPendingWechatMessages():
+    if not (leader.isLeader and getValue("wechatTokenAvailable")):
+        return
+    await outbox.refresh()
+    if len(outbox):
+        await outbox.drain(__sendOutboxMessage)
+
+
+async def __sendOutboxMessage(postDict):
+    return await __sendWechatMessage(tokenManager.token, postDict, False, priorityPending, True)
+
+
+__retryPolicy = retryPolicy()
+__weiboSendLock = locks.Lock()
+__chatSemaphore = locks.Semaphore(config["maxConcurrentChats"])
+inbox = inboxPoller()
+__batcher = messageBatcher(sendWechatMessage)
+tokenManager.addListener(sendPendingWechatMessages)
+getBreaker(qywxApiUrl).addListener(sendPendingWechatMessages)
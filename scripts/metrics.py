@@ -0,0 +1,119 @@
+from bisect import bisect_left
+
+
+def getMetric(metricClass, name, description, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    metric = metricRegistry.get(key)
+    if metric is None:
+        metric = metricClass(name, description, **labels)
+        metricRegistry[key] = metric
+    return metric
+
+
+def counter(name, description, **labels):
+    return getMetric(counterMetric, name, description, **labels)
+
+
+def gauge(name, description, **labels):
+    return getMetric(gaugeMetric, name, description, **labels)
+
+
+def histogram(name, description, buckets=None, **labels):
+    metric = getMetric(histogramMetric, name, description, **labels)
+    if buckets is not None and metric.buckets != tuple(buckets):
+        metric.setBuckets(buckets)
+    return metric
+
+
+def formatLabels(labels, **extraLabels):
+    labels = dict(labels, **extraLabels)
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in sorted(labels.items())) + "}"
+
+
+class baseMetric():
+    kind = "untyped"
+
+    def __init__(self, name, description, **labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+
+    def samples(self):
+        return []
+
+
+class counterMetric(baseMetric):
+    kind = "counter"
+
+    def __init__(self, name, description, **labels):
+        super().__init__(name, description, **labels)
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [(self.name, formatLabels(self.labels), self.value)]
+
+
+class gaugeMetric(counterMetric):
+    kind = "gauge"
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class histogramMetric(baseMetric):
+    kind = "histogram"
+
+    def __init__(self, name, description, **labels):
+        super().__init__(name, description, **labels)
+        self.setBuckets(defaultBuckets)
+
+    def setBuckets(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        samples = []
+        cumulative = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples.append((self.name + "_bucket",
+                            formatLabels(self.labels, le=bucket), cumulative))
+        samples.append((self.name + "_bucket",
+                        formatLabels(self.labels, le="+Inf"), self.count))
+        samples.append((self.name + "_sum", formatLabels(self.labels), self.sum))
+        samples.append((self.name + "_count",
+                        formatLabels(self.labels), self.count))
+        return samples
+
+
+def render():
+    lines = []
+    describedNames = set()
+    for (name, _), metric in sorted(metricRegistry.items(), key=lambda item: item[0]):
+        if name not in describedNames:
+            describedNames.add(name)
+            lines.append("# HELP {} {}".format(name, metric.description))
+            lines.append("# TYPE {} {}".format(name, metric.kind))
+        for sampleName, sampleLabels, value in metric.samples():
+            lines.append("{}{} {}".format(sampleName, sampleLabels, value))
+    return "\n".join(lines) + "\n"
+
+
+metricRegistry = {}
+defaultBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                  0.5, 1, 2.5, 5, 10, 30, 60)
@@ -0,0 +1,145 @@
+import time
+import pickle
+import asyncio
+import aiosqlite
+
+
+from configs import config, cacheFilePath, outboxTableStructure, outboxPending, outboxSending
+from log import generalLogger
+from metrics import counter, gauge
+from cluster import getWorkerCount
+
+
+class durableOutbox():
+    def __init__(self, dataBaseFilePath, tableName, capacity=None, overflowPolicy=None, batchSize=None, concurrency=None, maxAttempts=None, shared=False):
+        self.tableName = tableName
+        self.shared = shared
+        self.capacity = capacity if capacity is not None else config["maxPendingMessages"]
+        self.overflowPolicy = overflowPolicy if overflowPolicy is not None else config[
+            "outboxOverflowPolicy"]
+        self.batchSize = batchSize if batchSize is not None else config["outboxDrainBatchSize"]
+        self.concurrency = concurrency if concurrency is not None else config[
+            "outboxDrainConcurrency"]
+        self.maxAttempts = maxAttempts if maxAttempts is not None else config["maxTryCount"]
+        self.__dataBaseFilePath = dataBaseFilePath
+        self.__dataBase = None
+        self.__size = 0
+        self.__draining = False
+        self.__depth = gauge("outbox_pending_messages",
+                             "Wechat messages waiting in the durable outbox.")
+        self.__dropped = counter("outbox_dropped_messages_total",
+                                 "Wechat messages dropped by the outbox overflow policy or after too many attempts.")
+
+    def __len__(self):
+        return self.__size
+
+    async def open(self, recover=True):
+        self.__dataBase = await aiosqlite.connect(self.__dataBaseFilePath)
+        if self.shared:
+            await self.__dataBase.execute("pragma journal_mode=wal")
+        await self.__dataBase.execute("create table if not exists {} ({})".format(self.tableName, outboxTableStructure))
+        await self.__dataBase.execute("create index if not exists {0}_status on {0} (status, id)".format(self.tableName))
+        await self.__dataBase.commit()
+        if recover:
+            await self.recover()
+        await self.__count()
+        generalLogger.info("Outbox opened with {} pending wechat message(s).".format(self.__size))
+
+    async def recover(self):
+        await self.__dataBase.execute("update {} set status = ? where status = ?".format(self.tableName), (outboxPending, outboxSending))
+        await self.__dataBase.commit()
+
+    async def close(self):
+        if self.__dataBase is not None:
+            await self.__dataBase.close()
+            self.__dataBase = None
+
+    async def refresh(self):
+        if self.shared and self.__dataBase is not None:
+            await self.__count()
+
+    async def __count(self):
+        async with self.__dataBase.execute("select count(*) from {}".format(self.tableName)) as cursor:
+            self.__size, = await cursor.fetchone()
+        self.__depth.set(self.__size)
+
+    async def put(self, payload):
+        await self.refresh()
+        if self.__size >= self.capacity:
+            if self.overflowPolicy == "dropOldest":
+                cursor = await self.__dataBase.execute("delete from {0} where id = (select id from {0} where status = ? order by id limit 1)".format(self.tableName), (outboxPending,))
+                self.__size -= cursor.rowcount
+                self.__dropped.inc()
+                generalLogger.warning(
+                    "MaxPendingMessages has been reached, dropped the oldest pending wechat message.")
+            else:
+                self.__dropped.inc()
+                generalLogger.warning(
+                    "MaxPendingMessages has been reached, ignoring this wechat message.")
+                return False
+        await self.__dataBase.execute("insert into {} (payload, status, attempts, createTime) values (?, ?, 0, ?)".format(self.tableName),
+                                      (pickle.dumps(payload, pickle.HIGHEST_PROTOCOL), outboxPending, time.time()))
+        await self.__dataBase.commit()
+        self.__size += 1
+        self.__depth.set(self.__size)
+        generalLogger.info(
+            "WechatToken cannot be used temporarily, saved this wechat message until it can be sent.")
+        return True
+
+    async def drain(self, send):
+        if self.__draining or self.__dataBase is None:
+            return
+        self.__draining = True
+        semaphore = asyncio.Semaphore(self.concurrency)
+        stopped = False
+
+        async def sendRow(payload):
+            nonlocal stopped
+            async with semaphore:
+                if stopped:
+                    return notAttempted
+                result = await send(payload)
+                if result is notAttempted:
+                    stopped = True
+                return result
+        try:
+            while True:
+                async with self.__dataBase.execute("select id, payload, attempts from {} where status = ? order by id limit ?".format(self.tableName), (outboxPending, self.batchSize)) as cursor:
+                    rows = await cursor.fetchall()
+                if not rows:
+                    break
+                await self.__dataBase.executemany("update {} set status = ? where id = ?".format(self.tableName), [(outboxSending, row[0]) for row in rows])
+                await self.__dataBase.commit()
+                results = await asyncio.gather(*[sendRow(pickle.loads(row[1])) for row in rows], return_exceptions=True)
+                finishedIds = []
+                retryIds = []
+                skippedIds = []
+                for (rowId, _, attempts), result in zip(rows, results):
+                    if result is True:
+                        finishedIds.append((rowId,))
+                    elif result is notAttempted:
+                        skippedIds.append((outboxPending, rowId))
+                    elif attempts + 1 >= self.maxAttempts:
+                        generalLogger.warning(
+                            "Pending wechat message {} failed {} time(s), dropping it.".format(rowId, attempts + 1))
+                        self.__dropped.inc()
+                        finishedIds.append((rowId,))
+                    else:
+                        retryIds.append((outboxPending, rowId))
+                await self.__dataBase.executemany("delete from {} where id = ?".format(self.tableName), finishedIds)
+                await self.__dataBase.executemany("update {} set status = ?, attempts = attempts + 1 where id = ?".format(self.tableName), retryIds)
+                await self.__dataBase.executemany("update {} set status = ? where id = ?".format(self.tableName), skippedIds)
+                await self.__dataBase.commit()
+                self.__size -= len(finishedIds)
+                self.__depth.set(self.__size)
+                generalLogger.info("Drained {} pending wechat message(s), {} left for a later attempt.".format(
+                    len(finishedIds), len(retryIds) + len(skippedIds)))
+                if retryIds or skippedIds:
+                    break
+        finally:
+            self.__draining = False
+
+
+notAttempted = "notAttempted"
+outbox = durableOutbox(cacheFilePath, config["outboxTableName"],
+                       shared=getWorkerCount() > 1)
@@ -0,0 +1,122 @@
+import time
+import random
+import asyncio
+from tornado.ioloop import IOLoop
+from urllib.parse import urlsplit
+
+
+from configs import config, breakerClosed, breakerOpen, breakerHalfOpen
+from log import generalLogger
+from metrics import counter, gauge
+
+
+class retryableError(Exception):
+    pass
+
+
+class circuitOpenError(Exception):
+    pass
+
+
+class retryExhaustedError(Exception):
+    pass
+
+
+def getBreaker(url):
+    host = urlsplit(url).netloc
+    breaker = breakers.get(host)
+    if breaker is None:
+        breaker = circuitBreaker(host)
+        breakers[host] = breaker
+    return breaker
+
+
+class circuitBreaker():
+    def __init__(self, name, failureThreshold=None, resetTimeout=None):
+        self.name = name
+        self.failureThreshold = failureThreshold if failureThreshold is not None else config[
+            "breakerFailureThreshold"]
+        self.resetTimeout = resetTimeout if resetTimeout is not None else config["breakerResetTimeout"]
+        self.state = breakerClosed
+        self.__failures = 0
+        self.__openedAt = None
+        self.__trialRunning = False
+        self.__listeners = []
+        self.__stateGauge = gauge(
+            "circuit_breaker_state", "Circuit breaker state, 0 closed, 1 open, 2 half open.", host=name)
+        self.__trips = counter("circuit_breaker_trips_total",
+                               "Times the circuit breaker opened.", host=name)
+
+    def addListener(self, listener):
+        self.__listeners.append(listener)
+
+    def allow(self):
+        if self.state == breakerClosed:
+            return True
+        if self.state == breakerOpen and time.monotonic() - self.__openedAt >= self.resetTimeout:
+            self.__setState(breakerHalfOpen)
+        if self.state == breakerHalfOpen and not self.__trialRunning:
+            self.__trialRunning = True
+            return True
+        return False
+
+    def recordSuccess(self):
+        self.__failures = 0
+        self.__trialRunning = False
+        if self.state != breakerClosed:
+            generalLogger.info(
+                "Circuit of {} closed, requests are flowing again.".format(self.name))
+            self.__setState(breakerClosed)
+            self.__notify()
+
+    def recordFailure(self):
+        self.__failures += 1
+        self.__trialRunning = False
+        if self.state == breakerHalfOpen or (self.state == breakerClosed and self.__failures >= self.failureThreshold):
+            generalLogger.warning("Circuit of {} opened after {} failure(s), failing fast for {} seconds.".format(
+                self.name, self.__failures, self.resetTimeout))
+            self.__openedAt = time.monotonic()
+            self.__setState(breakerOpen)
+            self.__trips.inc()
+            IOLoop.current().call_later(self.resetTimeout, self.__notify)
+
+    def __setState(self, state):
+        self.state = state
+        self.__stateGauge.set(state)
+
+    def __notify(self):
+        for listener in self.__listeners:
+            IOLoop.current().add_callback(listener)
+
+
+class retryPolicy():
+    def __init__(self, maxAttempts=None, baseDelay=None, maxDelay=None):
+        self.maxAttempts = maxAttempts if maxAttempts is not None else config["maxTryCount"]
+        self.baseDelay = baseDelay if baseDelay is not None else config["retryBaseDelay"]
+        self.maxDelay = maxDelay if maxDelay is not None else config["retryMaxDelay"]
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** attempt))
+
+    async def call(self, breaker, func, *args, **kwargs):
+        for attempt in range(self.maxAttempts):
+            if not breaker.allow():
+                raise circuitOpenError(
+                    "Circuit of {} is open.".format(breaker.name))
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                breaker.recordFailure()
+                errorMessage = str(e) or e.__class__.__name__
+                if attempt + 1 == self.maxAttempts:
+                    raise retryExhaustedError(errorMessage)
+                delay = self.backoff(attempt)
+                generalLogger.warning("Request to {} failed, will retry in {:.2f} seconds, here is the error message:\n{}".format(
+                    breaker.name, delay, errorMessage))
+                await asyncio.sleep(delay)
+            else:
+                breaker.recordSuccess()
+                return result
+
+
+breakers = {}
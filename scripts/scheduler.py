@@ -1,22 +1,31 @@
+import json
+import time
 import pickle
+import sqlite3
 import aiosqlite
 import asyncio
+from heapq import heappush, heappop, heapify
 from tornado.ioloop import IOLoop
 from tornado.locks import Lock
 from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from functools import wraps
 
 
-from configs import config, stateStopped, stateRunning, statePaused, jobStoreTableStructure, jobStoreRetryInterval, timeoutMax, tasksFilePath
+from configs import config, stateStopped, stateRunning, statePaused, jobStoreTableStructure, jobRuntimeFields, jobStoreRetryInterval, wakeupBatchSize, timeoutMax, tasksFilePath
 from log import schedulerLogger
-from dataBase import syncDataBase
 from trigger import createTrigger
+from executor import createExecutor
+from metrics import histogram
 
 
-def restoreJob(jobStateBytes):
-    jobState = pickle.loads(jobStateBytes)
-    return job(jobState)
+def toTimestamp(runTime):
+    return runTime.timestamp() if runTime is not None else None
+
+
+def restoreJob(definition, jobId, nextRunTime, lastRunTime):
+    return job(id=jobId, nextRunTime=datetime.fromtimestamp(nextRunTime) if nextRunTime is not None else None,
+               lastRunTime=datetime.fromtimestamp(lastRunTime) if lastRunTime is not None else None, **definition)
 
 
 def setLock(func):
@@ -51,113 +60,294 @@ class job():
     def update(self, **kwargs):
         self.state.update(kwargs)
 
-    def getRunTimes(self, now):
-        runTimes = []
-        nextRunTime = self.state["nextRunTime"]
-        while nextRunTime is not None and nextRunTime <= now:
-            runTimes.append(nextRunTime)
-            nextRunTime = self.state["trigger"].getNextFireTime(
-                nextRunTime, now)
-        return runTimes
+    def getDefinition(self):
+        return {key: value for key, value in self.state.items() if key not in jobRuntimeFields}
+
+    def getRunSummary(self, now):
+        return self.state["trigger"].getFireSummary(self.state["nextRunTime"], now)
+
+    def iterRunTimes(self, now, since=None):
+        return self.state["trigger"].iterFireTimes(self.state["nextRunTime"], now, since)
+
+
+class runTimeIndex():
+    def __init__(self):
+        self.__heap = []
+        self.__runTimes = {}
+
+    def __len__(self):
+        return len(self.__runTimes)
+
+    def clear(self):
+        self.__heap = []
+        self.__runTimes = {}
+
+    def get(self, jobStoreName, jobId):
+        return self.__runTimes.get((jobStoreName, jobId))
+
+    def set(self, jobStoreName, jobId, nextRunTime):
+        key = (jobStoreName, jobId)
+        if nextRunTime is None:
+            self.__runTimes.pop(key, None)
+            return
+        if self.__runTimes.get(key) == nextRunTime:
+            return
+        self.__runTimes[key] = nextRunTime
+        heappush(self.__heap, (nextRunTime, jobStoreName, jobId))
+        if len(self.__heap) > 2 * len(self.__runTimes) + 64:
+            self.__heap = [(runTime, jobStoreName, jobId) for (
+                jobStoreName, jobId), runTime in self.__runTimes.items()]
+            heapify(self.__heap)
+
+    def discard(self, jobStoreName):
+        for key in [key for key in self.__runTimes if key[0] == jobStoreName]:
+            del self.__runTimes[key]
+
+    def peek(self):
+        while self.__heap:
+            runTime, jobStoreName, jobId = self.__heap[0]
+            if self.__runTimes.get((jobStoreName, jobId)) == runTime:
+                return runTime
+            heappop(self.__heap)
+        return None
+
+    def popDue(self, now):
+        dueEntries = defaultdict(list)
+        while self.__heap and self.__heap[0][0] <= now:
+            runTime, jobStoreName, jobId = heappop(self.__heap)
+            if self.__runTimes.get((jobStoreName, jobId)) == runTime:
+                del self.__runTimes[(jobStoreName, jobId)]
+                dueEntries[jobStoreName].append((jobId, runTime))
+        return dueEntries
 
 
 class jobStore():
-    def __init__(self, dataBaseFilePath, tableName, pickleProtocol=pickle.HIGHEST_PROTOCOL):
+    def __init__(self, dataBaseFilePath, tableName, cacheSize=None, pickleProtocol=pickle.HIGHEST_PROTOCOL):
         self.tableName = tableName
+        self.cacheSize = cacheSize
         self.__dataBaseFilePath = dataBaseFilePath
         self.__pickleProtocol = pickleProtocol
+        self.__dataBase = None
+        self.lock = Lock()
+        self.__jobs = OrderedDict()
+        self.__complete = False
+        self.__writes = []
+        self.__bulkWrites = []
+        self.__bulkJobIds = set()
+        self.__flushTask = None
+        self.__sql = {
+            "insert": "insert into {} values (?,?,?,?)".format(tableName),
+            "replace": "insert or replace into {} values (?,?,?,?)".format(tableName),
+            "remove": "delete from {} where id = ?".format(tableName),
+            "removeAll": "delete from {}".format(tableName),
+            "load": "select id, nextRunTime, lastRunTime, definition from {} order by case when nextRunTime is null then 1 else 0 end, nextRunTime asc limit ?".format(tableName),
+            "getAll": "select id, nextRunTime, lastRunTime, definition from {} order by case when nextRunTime is null then 1 else 0 end, nextRunTime asc".format(tableName),
+            "getRunTimes": "select id, nextRunTime from {} where nextRunTime is not null".format(tableName),
+            "getByIds": "select id, nextRunTime, lastRunTime, definition from {} where id in (select value from json_each(?))".format(tableName),
+            "update": "update {} set nextRunTime = ?, lastRunTime = ?, definition = ? where id = ?".format(tableName),
+            "updateRunTimes": "update {} set nextRunTime = ?, lastRunTime = ? where id = ?".format(tableName)
+        }
 
-    def start(self):
-        with syncDataBase(self.__dataBaseFilePath) as dataBase:
-            tableNames = dataBase.tableNames()
-            if self.tableName not in tableNames:
-                dataBase.createTable(self.tableName, jobStoreTableStructure)
+    async def start(self):
+        self.__dataBase = await aiosqlite.connect(self.__dataBaseFilePath)
+        await self.__dataBase.execute("pragma journal_mode=wal")
+        await self.__dataBase.execute("pragma synchronous=normal")
+        async with self.__dataBase.execute("pragma table_info({})".format(self.tableName)) as cursor:
+            columnNames = [row[1] async for row in cursor]
+        if "state" in columnNames:
+            await self.__migrate()
+        await self.__dataBase.execute("create table if not exists {} ({})".format(self.tableName, jobStoreTableStructure))
+        await self.__dataBase.execute("create index if not exists {0}_nextRunTime on {0} (nextRunTime)".format(self.tableName))
+        await self.__dataBase.commit()
+        self.__jobs.clear()
+        self.__complete = True
+        jobs = await self.__getJobs(self.__sql["load"], self.cacheSize if self.cacheSize else -1)
+        if self.cacheSize and len(jobs) >= self.cacheSize:
+            self.__complete = False
+        schedulerLogger.info("Cached {} job(s) of table {}.".format(
+            len(self.__jobs), self.tableName))
+
+    async def close(self):
+        if self.__flushTask is not None:
+            await asyncio.gather(asyncio.shield(self.__flushTask), return_exceptions=True)
+        self.__jobs.clear()
+        self.__complete = False
+        if self.__dataBase is not None:
+            await self.__dataBase.close()
+            self.__dataBase = None
+
+    def addJob(self, job, replaceExisting=False):
+        if not replaceExisting and job.state["id"] in self.__jobs:
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: {}.id".format(self.tableName))
+        self.__cacheJob(job)
+        return self.__write([(self.__sql["replace" if replaceExisting else "insert"], [(job.state["id"], toTimestamp(job.state["nextRunTime"]),
+                                                                                      toTimestamp(job.state.get("lastRunTime")), pickle.dumps(job.getDefinition(), self.__pickleProtocol))])],
+                            [job.state["id"]])
+
+    def removeJob(self, jobId):
+        self.__jobs.pop(jobId, None)
+        return self.__write([(self.__sql["remove"], [(jobId,)])], [jobId])
+
+    def removeJobs(self):
+        self.__jobs.clear()
+        self.__complete = True
+        return self.__write([(self.__sql["removeAll"], [()])])
 
-    def syncAddJob(self, job):
-        with syncDataBase(self.__dataBaseFilePath) as dataBase:
-            dataBase.insertRow(self.tableName, job.state["id"], job.state["nextRunTime"].timestamp(
-            ) if job.state["nextRunTime"] is not None else None, pickle.dumps(job.state, self.__pickleProtocol))
+    async def getJob(self, jobId):
+        jobs = await self.getJobsById([jobId])
+        return jobs[0] if jobs else None
 
-    async def addJob(self, job):
-        sql = "insert into {} values (?,?,?)".format(self.tableName)
-        variables = (job.state["id"], job.state["nextRunTime"].timestamp(
-        ) if job.state["nextRunTime"] is not None else None, pickle.dumps(job.state, self.__pickleProtocol))
-        await self.__execute(sql, *variables)
+    async def getJobs(self):
+        if self.__complete:
+            return sorted((job(**cachedJob.state) for cachedJob in self.__jobs.values()), key=lambda job: (
+                job.state["nextRunTime"] is None, job.state["nextRunTime"] or datetime.min))
+        return await self.__getJobs(self.__sql["getAll"])
 
-    async def removeJob(self, jobId):
-        sql = "delete from {} where id = '{}'".format(self.tableName, jobId)
-        await self.__execute(sql)
+    async def getRunTimes(self):
+        async with self.__dataBase.execute(self.__sql["getRunTimes"]) as cursor:
+            return [(row[0], datetime.fromtimestamp(row[1])) async for row in cursor]
 
-    async def removeJobs(self):
-        sql = "delete from {}".format(self.tableName)
-        await self.__execute(sql)
+    async def getJobsById(self, jobIds):
+        jobs = []
+        missingJobIds = []
+        for jobId in jobIds:
+            cachedJob = self.__jobs.get(jobId)
+            if cachedJob is not None:
+                self.__jobs.move_to_end(jobId)
+                jobs.append(job(**cachedJob.state))
+            elif not self.__complete:
+                missingJobIds.append(jobId)
+        if missingJobIds:
+            jobs.extend(await self.__getJobs(self.__sql["getByIds"], json.dumps(missingJobIds)))
+        return jobs
 
-    async def getJob(self, jobId):
-        async with aiosqlite.connect(self.__dataBaseFilePath) as dataBase:
-            async with dataBase.cursor() as cursor:
-                sql = "select state from {} where id = '{}'".format(
-                    self.tableName, jobId)
-                await cursor.execute(sql)
-                resultRow = await cursor.fetchone()
-                if resultRow is not None:
-                    job = restoreJob(resultRow[0])
+    def applyChanges(self, updatedJobs=(), removedJobIds=()):
+        for job in updatedJobs:
+            self.__cacheJob(job)
+        for jobId in removedJobIds:
+            self.__jobs.pop(jobId, None)
+        return self.__write([(self.__sql["updateRunTimes"], [(toTimestamp(job.state["nextRunTime"]), toTimestamp(job.state.get("lastRunTime")),
+                                                              job.state["id"]) for job in updatedJobs]),
+                             (self.__sql["remove"], [(jobId,) for jobId in removedJobIds])],
+                            [job.state["id"] for job in updatedJobs] + list(removedJobIds), True)
+
+    def updateJob(self, job, definitionChanged=True):
+        self.__cacheJob(job)
+        if definitionChanged:
+            return self.__write([(self.__sql["update"], [(toTimestamp(job.state["nextRunTime"]), toTimestamp(job.state.get("lastRunTime")),
+                                                         pickle.dumps(job.getDefinition(), self.__pickleProtocol), job.state["id"])])], [job.state["id"]])
+        return self.__write([(self.__sql["updateRunTimes"], [(toTimestamp(job.state["nextRunTime"]), toTimestamp(job.state.get("lastRunTime")), job.state["id"])])],
+                            [job.state["id"]])
+
+    def __cacheJob(self, job):
+        self.__jobs[job.state["id"]] = job
+        self.__jobs.move_to_end(job.state["id"])
+        if self.cacheSize and len(self.__jobs) > self.cacheSize:
+            self.__jobs.popitem(last=False)
+            self.__complete = False
+
+    def __write(self, statements, jobIds=None, bulk=False):
+        waiter = asyncio.get_event_loop().create_future()
+        if bulk:
+            self.__bulkWrites.append((statements, waiter))
+            self.__bulkJobIds.update(jobIds)
+        else:
+            if self.__bulkWrites and (jobIds is None or not self.__bulkJobIds.isdisjoint(jobIds)):
+                self.__writes.extend(self.__bulkWrites)
+                self.__bulkWrites = []
+                self.__bulkJobIds = set()
+            self.__writes.append((statements, waiter))
+        if self.__flushTask is None:
+            self.__flushTask = asyncio.ensure_future(self.__flush())
+        return waiter
+
+    async def __flush(self):
+        try:
+            while self.__writes or self.__bulkWrites:
+                if self.__writes:
+                    writes, self.__writes = self.__writes, []
                 else:
-                    job = None
-        return job
-
-    async def getJobs(self):
-        return await self.__getJobs("order by case when nextRunTime is null then 1 else 0 end, nextRunTime asc")
-
-    async def getDueJobs(self, now):
-        return await self.__getJobs("where nextRunTime <= {} order by nextRunTime asc".format(now.timestamp()))
-
-    async def getNextRunTime(self):
-        async with aiosqlite.connect(self.__dataBaseFilePath) as dataBase:
-            async with dataBase.cursor() as cursor:
-                sql = "select nextRunTime from {} where nextRunTime is not null order by nextRunTime asc limit 1".format(
-                    self.tableName)
-                await cursor.execute(sql)
-                resultRow = await cursor.fetchone()
-                if resultRow is not None:
-                    nextRunTime = datetime.fromtimestamp(resultRow[0])
+                    writes, self.__bulkWrites = self.__bulkWrites, []
+                    self.__bulkJobIds = set()
+                try:
+                    await self.__executeWrites(writes)
+                except Exception:
+                    await self.__dataBase.rollback()
+                    for write in writes:
+                        try:
+                            await self.__executeWrites((write,))
+                        except Exception as e:
+                            await self.__dataBase.rollback()
+                            schedulerLogger.warning("Error writing to table {}, here is the error message:\n{}".format(
+                                self.tableName, e))
+                            self.__jobs.clear()
+                            self.__complete = False
+                            write[1].set_exception(e)
+                        else:
+                            write[1].set_result(None)
                 else:
-                    nextRunTime = None
-        return nextRunTime
-
-    async def updateJob(self, job):
-        sql = "update {} set nextRunTime=(?), state=(?) where id = '{}'".format(
-            self.tableName, job.state["id"])
-        variables = (job.state["nextRunTime"].timestamp() if job.state["nextRunTime"] is not None else None,
-                     pickle.dumps(job.state, self.__pickleProtocol))
-        await self.__execute(sql, *variables)
-
-    async def __execute(self, sql, *variables):
-        async with aiosqlite.connect(self.__dataBaseFilePath) as dataBase:
-            async with dataBase.cursor() as cursor:
-                await cursor.execute(sql, variables)
-                await dataBase.commit()
-
-    async def __getJobs(self, *conditions):
+                    for _, waiter in writes:
+                        waiter.set_result(None)
+        finally:
+            self.__flushTask = None
+
+    async def __executeWrites(self, writes):
+        merged = []
+        for statements, _ in writes:
+            for sql, rows in statements:
+                if not rows:
+                    continue
+                if merged and merged[-1][0] == sql:
+                    merged[-1][1].extend(rows)
+                else:
+                    merged.append((sql, list(rows)))
+        for sql, rows in merged:
+            await self.__dataBase.executemany(sql, rows)
+        await self.__dataBase.commit()
+
+    async def __getJobs(self, sql, *variables):
         jobs = []
         failedJobIds = set()
-        async with aiosqlite.connect(self.__dataBaseFilePath) as dataBase:
-            async with dataBase.cursor() as cursor:
-                sql = "select id, state from {}".format(self.tableName)
-                sql = " ".join((sql,) + conditions)
-                await cursor.execute(sql)
-                async for row in cursor:
-                    try:
-                        jobs.append(restoreJob(row[1]))
-                    except Exception as e:
-                        schedulerLogger.warning(
-                            "Unable to restore job {} -- removing it. Here is the error message:\n{}".format(row[0], e))
-                        failedJobIds.add((row[0],))
-                if failedJobIds:
-                    sql = "delete from {} where id = (?)".format(self.tableName)
-                    await cursor.executemany(sql, failedJobIds)
-                    await cursor.commit()
+        if self.__flushTask is not None:
+            await asyncio.gather(asyncio.shield(self.__flushTask), return_exceptions=True)
+        async with self.__dataBase.execute(sql, variables) as cursor:
+            async for jobId, nextRunTime, lastRunTime, definitionBytes in cursor:
+                try:
+                    restoredJob = restoreJob(pickle.loads(
+                        definitionBytes), jobId, nextRunTime, lastRunTime)
+                except Exception as e:
+                    schedulerLogger.warning(
+                        "Unable to restore job {} -- removing it. Here is the error message:\n{}".format(jobId, e))
+                    failedJobIds.add((jobId,))
+                    continue
+                jobs.append(restoredJob)
+        if failedJobIds:
+            await self.__write([(self.__sql["remove"], failedJobIds)], [jobId for jobId, in failedJobIds])
+        for restoredJob in jobs:
+            self.__cacheJob(job(**restoredJob.state))
         return jobs
 
+    async def __migrate(self):
+        legacyTableName = self.tableName + "_legacy"
+        await self.__dataBase.execute("alter table {} rename to {}".format(self.tableName, legacyTableName))
+        await self.__dataBase.execute("create table {} ({})".format(self.tableName, jobStoreTableStructure))
+        rows = []
+        async with self.__dataBase.execute("select id, nextRunTime, state from {}".format(legacyTableName)) as cursor:
+            async for jobId, nextRunTime, stateBytes in cursor:
+                try:
+                    legacyJob = job(**pickle.loads(stateBytes))
+                except Exception as e:
+                    schedulerLogger.warning(
+                        "Unable to restore job {} -- removing it. Here is the error message:\n{}".format(jobId, e))
+                    continue
+                rows.append((jobId, nextRunTime, None, pickle.dumps(
+                    legacyJob.getDefinition(), self.__pickleProtocol)))
+        await self.__dataBase.executemany(self.__sql["insert"], rows)
+        await self.__dataBase.execute("drop table {}".format(legacyTableName))
+        await self.__dataBase.commit()
+        schedulerLogger.info("Migrated {} job(s) of table {} to the split schema.".format(
+            len(rows), self.tableName))
+
 
 class tornadoScheduler():
     __ioLoop = IOLoop.current()
@@ -168,21 +358,33 @@ class tornadoScheduler():
         self.lock = Lock()
         self.__jobStores = {}
         self.__timeout = None
-        self.__instances = defaultdict(lambda: 0)
+        self.__nextWakeupTime = None
+        self.__executors = {executorName: createExecutor(
+            executorName) for executorName in ("asyncio", "thread", "process")}
         self.__pendingJobs = []
+        self.__runTimeIndex = runTimeIndex()
+        self.__touchedJobs = None
+        self.__dueJobs = histogram("scheduler_due_jobs_per_wakeup", "Due jobs found by one scheduler wakeup.", buckets=(
+            0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000))
+        self.__processTimes = {}
         for index, jobStoreName in enumerate(self.jobStoreNames):
-            self.__jobStores[jobStoreName] = jobStore(
-                dataBaseFilePath, tableNames[index])
+            self.__processTimes[jobStoreName] = histogram("scheduler_process_jobs_seconds",
+                                                          "Time a wakeup spent processing the due jobs of one job store.", store=jobStoreName)
+            self.__jobStores[jobStoreName] = jobStore(dataBaseFilePath, tableNames[index],
+                                                      config["temporaryJobCacheSize"] if jobStoreName == "temporary" else None)
 
-    def start(self, paused=False):
+    async def start(self, paused=False):
         if self.state != stateStopped:
             schedulerLogger.error("Scheduler already running.")
             raise RuntimeError("Scheduler already running.")
         for jobStoreName in self.jobStoreNames:
-            self.__jobStores[jobStoreName].start()
-        for job, jobStoreName in self.__pendingJobs:
-            self.__jobStores[jobStoreName].syncAddJob(job)
+            await self.__jobStores[jobStoreName].start()
+        await asyncio.gather(*[self.__jobStores[jobStoreName].addJob(job, True) for job, jobStoreName in self.__pendingJobs])
         del self.__pendingJobs[:]
+        self.__runTimeIndex.clear()
+        for jobStoreName in self.jobStoreNames:
+            for jobId, nextRunTime in await self.__jobStores[jobStoreName].getRunTimes():
+                self.__runTimeIndex.set(jobStoreName, jobId, nextRunTime)
         self.state = statePaused if paused else stateRunning
         schedulerLogger.info("Scheduler started.")
         if not paused:
@@ -202,6 +404,12 @@ class tornadoScheduler():
         if self.__timeout is not None:
             tornadoScheduler.__ioLoop.remove_timeout(self.__timeout)
             self.__timeout = None
+        for jobStoreName in self.jobStoreNames:
+            async with self.__jobStores[jobStoreName].lock:
+                await self.__jobStores[jobStoreName].close()
+        for executor in self.__executors.values():
+            executor.shutdown()
+        self.__nextWakeupTime = None
         self.state = stateStopped
         schedulerLogger.info("Scheduler has been shutdown.")
 
@@ -224,12 +432,25 @@ class tornadoScheduler():
             raise RuntimeError("Scheduler not running.")
         elif self.state == statePaused:
             self.state = stateRunning
+            self.__nextWakeupTime = None
             tornadoScheduler.__ioLoop.add_callback(self.__wakeup)
             schedulerLogger.info("Resumed scheduler job processing.")
 
-    @setLock
     async def addJob(self, jobId, func, args=None, kwargs=None, description="undefined", jobStoreName="temporary",
-                     triggerName="date", misfireGraceTime=60, coalesce=True, maxInstances=1, nextRunTime="undefined", **triggerArgs):
+                     triggerName="date", misfireGraceTime=60, coalesce=True, maxInstances=1, nextRunTime="undefined", replaceExisting=False, executor="asyncio", **triggerArgs):
+        if executor not in self.__executors:
+            schedulerLogger.error("Unsupported executor type {}".format(executor))
+            raise TypeError("Unsupported executor type {}".format(executor))
+        if executor != "asyncio" and asyncio.iscoroutinefunction(func):
+            schedulerLogger.error(
+                "Coroutine function of job {} can only run on the asyncio executor.".format(jobId))
+            raise TypeError(
+                "Coroutine function of job {} can only run on the asyncio executor.".format(jobId))
+        if executor == "asyncio" and not asyncio.iscoroutinefunction(func):
+            schedulerLogger.error(
+                "Synchronous function of job {} needs the thread or process executor.".format(jobId))
+            raise TypeError(
+                "Synchronous function of job {} needs the thread or process executor.".format(jobId))
         trigger = createTrigger(triggerName, triggerArgs)
         jobKwargs = {
             "id": jobId,
@@ -241,25 +462,35 @@ class tornadoScheduler():
             "misfireGraceTime": misfireGraceTime,
             "coalesce": coalesce,
             "maxInstances": maxInstances,
-            "nextRunTime": nextRunTime if nextRunTime != "undefined" else trigger.getNextFireTime(None, datetime.utcnow())
+            "executor": executor,
+            "nextRunTime": nextRunTime if nextRunTime != "undefined" else trigger.getNextFireTime(None, datetime.utcnow()),
+            "lastRunTime": None
         }
-        job = job(**jobKwargs)
+        newJob = job(**jobKwargs)
         if self.state == stateStopped:
-            self.__pendingJobs.append((job, jobStoreName))
+            if replaceExisting:
+                self.__pendingJobs = [pending for pending in self.__pendingJobs if pending[0].state["id"]
+                                      != jobId or pending[1] != jobStoreName]
+            self.__pendingJobs.append((newJob, jobStoreName))
             schedulerLogger.info(
                 "Adding job tentatively -- it will be properly scheduled when the scheduler starts.")
         else:
-            await self.__jobStores[jobStoreName].addJob(job)
+            async with self.__jobStores[jobStoreName].lock:
+                write = self.__jobStores[jobStoreName].addJob(
+                    newJob, replaceExisting)
+                self.__touchJob(jobStoreName, jobId)
+                self.__runTimeIndex.set(
+                    jobStoreName, jobId, newJob.state["nextRunTime"])
+            await write
             schedulerLogger.info("Added job '{}' to table '{}'.".format(
-                job, self.__jobStores[jobStoreName].tableName))
-            if self.state == stateRunning:
-                tornadoScheduler.__ioLoop.add_callback(self.__wakeup)
+                newJob, self.__jobStores[jobStoreName].tableName))
+            self.__requestWakeup(newJob.state["nextRunTime"])
 
-    @setLock
     async def removeJob(self, jobId, jobStoreName="temporary"):
-        await self.__removeJob()
+        async with self.__jobStores[jobStoreName].lock:
+            write = await self.__removeJob(jobId, jobStoreName)
+        await self.__waitForWrite(write)
 
-    @setLock
     async def removeJobs(self, jobStoreName=None):
         if self.state == stateStopped:
             if jobStoreName is not None:
@@ -270,13 +501,16 @@ class tornadoScheduler():
         else:
             for job_store_name in self.jobStoreNames:
                 if jobStoreName is None or job_store_name == jobStoreName:
-                    await self.__jobStores[job_store_name].removeJobs()
+                    async with self.__jobStores[job_store_name].lock:
+                        write = self.__jobStores[job_store_name].removeJobs()
+                        self.__touchJob(job_store_name, None)
+                        self.__runTimeIndex.discard(job_store_name)
+                    await write
 
-    @setLock
     async def getJob(self, jobId, jobStoreName="temporary"):
-        return await self.__getJob(jobId, jobStoreName)
+        async with self.__jobStores[jobStoreName].lock:
+            return await self.__getJob(jobId, jobStoreName)
 
-    @setLock
     async def getJobs(self, jobStoreName=None):
         jobs = []
         if self.state == stateStopped:
@@ -286,68 +520,78 @@ class tornadoScheduler():
         else:
             for job_store_name in self.jobStoreNames:
                 if jobStoreName is None or job_store_name == jobStoreName:
-                    jobs.extend(await self.__jobStores[job_store_name].getJobs())
+                    async with self.__jobStores[job_store_name].lock:
+                        jobs.extend(await self.__jobStores[job_store_name].getJobs())
         return jobs
 
-    @setLock
     async def updateJob(self, jobId, jobStoreName="temporary", **changes):
-        await self.__modifyJob(jobId, jobStoreName, **changes)
+        async with self.__jobStores[jobStoreName].lock:
+            write = await self.__modifyJob(jobId, jobStoreName, **changes)
+        await self.__waitForWrite(write)
 
-    @setLock
     async def pauseJob(self, jobId, jobStoreName="temporary"):
-        await self.__modifyJob(jobId, jobStoreName, nextRunTime=None)
+        async with self.__jobStores[jobStoreName].lock:
+            write = await self.__modifyJob(jobId, jobStoreName, nextRunTime=None)
+        await self.__waitForWrite(write)
 
-    @setLock
     async def resumeJob(self, jobId, jobStoreName="temporary"):
-        job = await self.__getJob(jobId, jobStoreName)
-        nextRunTime = job.state["trigger"].getNextFireTime(
-            None, datetime.utcnow())
-        if nextRunTime is not None:
-            await self.__modifyJob(jobId, jobStoreName, nextRunTime=nextRunTime)
-        else:
-            await self.__removeJob(jobId, jobStoreName)
+        async with self.__jobStores[jobStoreName].lock:
+            job = await self.__getJob(jobId, jobStoreName)
+            nextRunTime = job.state["trigger"].getNextFireTime(
+                None, datetime.utcnow())
+            if nextRunTime is not None:
+                write = await self.__modifyJob(jobId, jobStoreName, nextRunTime=nextRunTime)
+            else:
+                write = await self.__removeJob(jobId, jobStoreName)
+        await self.__waitForWrite(write)
 
-    @setLock
     async def rescheduleJob(self, jobId, jobStoreName="temporary", triggerName="date", **triggerArgs):
         trigger = createTrigger(triggerName, triggerArgs)
         nextRunTime = trigger.getNextFireTime(None, datetime.utcnow())
-        await self.__modifyJob(jobId, jobStoreName, trigger=trigger, nextRunTime=nextRunTime)
+        async with self.__jobStores[jobStoreName].lock:
+            write = await self.__modifyJob(jobId, jobStoreName, trigger=trigger, nextRunTime=nextRunTime)
+        await self.__waitForWrite(write)
 
     def submitJob(self, job, runTimes):
-        if self.__instances[job.state["id"]] >= job.state["maxInstances"]:
+        executor = self.__executors[job.state.get("executor", "asyncio")]
+        if executor.isFull(job):
+            executor.skipped.inc()
             schedulerLogger.warning("Execution of job '{}' skipped: maximum number of running instances reached ({})".format(
                 job, job.state["maxInstances"]))
         else:
-            def callback(future):
-                self.__instances[job.state["id"]] -= 1
-                if self.__instances[job.state["id"]] == 0:
-                    del self.__instances[job.state["id"]]
             graceTime = timedelta(seconds=job.state["misfireGraceTime"])
-            tasks = []
+            dueRunTimes = []
             for runTime in runTimes:
                 difference = datetime.utcnow() - runTime
                 if difference > graceTime:
+                    executor.missed.inc()
                     schedulerLogger.warning(
                         "Run time of job '{}' was missed by '{}'".format(job, difference))
                     continue
-                tasks.append(job.state["func"](
-                    *job.state["args"], **job.state["kwargs"]))
-            if tasks:
-                tasks = asyncio.gather(*tasks)
-                tasks.add_done_callback(callback)
-                self.__instances[job.state["id"]] += 1
-                schedulerLogger.info(
-                    "Submit job '{}' successfully.".format(job))
+                dueRunTimes.append(runTime)
+            if dueRunTimes:
+                try:
+                    executor.submit(job, dueRunTimes)
+                except Exception as e:
+                    schedulerLogger.warning("Unable to submit job '{}' to executor '{}', here is the error message:\n{}".format(
+                        job, executor.name, e))
+                else:
+                    schedulerLogger.info(
+                        "Submit job '{}' to executor '{}' successfully.".format(job, executor.name))
 
     async def __removeJob(self, jobId, jobStoreName="temporary"):
+        write = None
         if self.state == stateStopped:
             for index, (job, job_store_name) in enumerate(self.__pendingJobs):
                 if job.state["id"] == jobId and job_store_name == jobStoreName:
                     del self.__pendingJobs[index]
                     break
         else:
-            await self.__jobStores[jobStoreName].removeJob(jobId)
+            write = self.__jobStores[jobStoreName].removeJob(jobId)
+            self.__touchJob(jobStoreName, jobId)
+            self.__runTimeIndex.set(jobStoreName, jobId, None)
         schedulerLogger.info("Removed job {}".format(jobId))
+        return write
 
     async def __getJob(self, jobId, jobStoreName="temporary"):
         if self.state == stateStopped:
@@ -359,11 +603,34 @@ class tornadoScheduler():
         return None
 
     async def __modifyJob(self, jobId, jobStoreName="temporary", **changes):
+        write = None
         job = await self.__getJob(jobId, jobStoreName)
         job.update(**changes)
         if self.state != stateStopped:
-            await self.__jobStores[jobStoreName].updateJob(job)
-        if self.state == stateRunning:
+            write = self.__jobStores[jobStoreName].updateJob(
+                job, any(key not in jobRuntimeFields for key in changes))
+            self.__touchJob(jobStoreName, jobId)
+            self.__runTimeIndex.set(
+                jobStoreName, jobId, job.state["nextRunTime"])
+        self.__requestWakeup(job.state["nextRunTime"])
+        return write
+
+    def __touchJob(self, jobStoreName, jobId):
+        if self.__touchedJobs is not None:
+            self.__touchedJobs.add((jobStoreName, jobId))
+
+    def __isTouched(self, jobStoreName, jobId):
+        return (jobStoreName, jobId) in self.__touchedJobs or (jobStoreName, None) in self.__touchedJobs
+
+    async def __waitForWrite(self, write):
+        if write is not None:
+            await write
+
+    def __requestWakeup(self, runTime):
+        if self.state != stateRunning or runTime is None:
+            return
+        if self.__nextWakeupTime is None or runTime < self.__nextWakeupTime:
+            self.__nextWakeupTime = runTime
             tornadoScheduler.__ioLoop.add_callback(self.__wakeup)
 
     @setLock
@@ -375,40 +642,97 @@ class tornadoScheduler():
         if self.__timeout is not None:
             tornadoScheduler.__ioLoop.remove_timeout(self.__timeout)
             self.__timeout = None
+        self.__nextWakeupTime = datetime.utcnow()
         nextWakeupTime = await self.__processJobs()
+        self.__nextWakeupTime = nextWakeupTime
         if nextWakeupTime is not None:
             self.__timeout = tornadoScheduler.__ioLoop.add_timeout(
                 nextWakeupTime - datetime.utcnow(), self.__wakeup)
 
-    async def __processJobs(self):
-        schedulerLogger.debug("Looking for jobs to run.")
-        nextWakeupTime = None
-        now = datetime.utcnow()
-        for jobStoreName in self.jobStoreNames:
+    async def __processDueJobs(self, jobStoreName, dueEntries, now):
+        try:
+            dueJobs = await self.__jobStores[jobStoreName].getJobsById([jobId for jobId, _ in dueEntries])
+        except Exception as e:
+            schedulerLogger.warning("Error getting due jobs from table {}, here is the error message:\n{}".format(
+                self.__jobStores[jobStoreName].tableName, e))
+            self.__retryDueEntries(jobStoreName, dueEntries, now)
+            return
+        async with self.__jobStores[jobStoreName].lock:
+            return self.__runDueJobs(jobStoreName, dueJobs, now)
+
+    def __runDueJobs(self, jobStoreName, dueJobs, now):
+        updatedJobs = []
+        removedJobIds = []
+        for job in dueJobs:
+            if self.__isTouched(jobStoreName, job.state["id"]):
+                continue
+            runCount, lastRunTime = job.getRunSummary(now)
+            if lastRunTime is None:
+                self.__runTimeIndex.set(
+                    jobStoreName, job.state["id"], job.state["nextRunTime"])
+                continue
+            if job.state["coalesce"]:
+                runTimes = [lastRunTime]
+            else:
+                graceStart = now - \
+                    timedelta(seconds=job.state["misfireGraceTime"])
+                missedCount, _ = job.getRunSummary(graceStart)
+                if missedCount:
+                    schedulerLogger.warning("{} run time(s) of job '{}' were missed by more than {} seconds".format(
+                        missedCount, job, job.state["misfireGraceTime"]))
+                runTimes = job.iterRunTimes(now, graceStart)
+            self.submitJob(job, runTimes)
+            jobNextRunTime = job.state["trigger"].getNextFireTime(
+                lastRunTime, now)
+            job.state["lastRunTime"] = lastRunTime
+            if jobNextRunTime is not None:
+                job.state["nextRunTime"] = jobNextRunTime
+                updatedJobs.append(job)
+                self.__runTimeIndex.set(
+                    jobStoreName, job.state["id"], jobNextRunTime)
+            else:
+                removedJobIds.append(job.state["id"])
+        if updatedJobs or removedJobIds:
+            return self.__jobStores[jobStoreName].applyChanges(updatedJobs, removedJobIds)
+
+    def __retryDueEntries(self, jobStoreName, dueEntries, now):
+        retryWakeupTime = now + timedelta(seconds=jobStoreRetryInterval)
+        for jobId, _ in dueEntries:
+            if self.__runTimeIndex.get(jobStoreName, jobId) is None:
+                self.__runTimeIndex.set(jobStoreName, jobId, retryWakeupTime)
+
+    async def __processStoreJobs(self, jobStoreName, dueEntries, now):
+        startTime = time.perf_counter()
+        writes = []
+        for index in range(0, len(dueEntries), wakeupBatchSize):
+            chunk = dueEntries[index:index + wakeupBatchSize]
             try:
-                dueJobs = await self.__jobStores[jobStoreName].getDueJobs(now)
+                writes.append(await self.__processDueJobs(jobStoreName, chunk, now))
             except Exception as e:
-                schedulerLogger.warning("Error getting due jobs from table {}, here is the error message:\n{}".format(
+                schedulerLogger.warning("Error processing due jobs from table {}, here is the error message:\n{}".format(
                     self.__jobStores[jobStoreName].tableName, e))
-                retryWakeupTime = now + \
-                    timedelta(seconds=jobStoreRetryInterval)
-                if nextWakeupTime is None or retryWakeupTime < nextWakeupTime:
-                    nextWakeupTime = retryWakeupTime
-                continue
-            for job in dueJobs:
-                runTimes = job.getRunTimes()
-                runTimes = runTimes[-1:] if job.state["coalesce"] else runTimes
-                self.submitJob(job, runTimes)
-                jobNextRunTime = job.state["trigger"].getNextFireTime(
-                    runTimes[-1], now)
-                if jobNextRunTime is not None:
-                    job.state["nextRunTime"] = jobNextRunTime
-                    await self.__jobStores[jobStoreName].updateJob(job)
-                else:
-                    await self.__jobStores[jobStoreName].removeJob(job.state["id"])
-            jobStoreNextRunTime = await self.__jobStores[jobStoreName].getNextRunTime()
-            if jobStoreNextRunTime is not None and (nextWakeupTime is None or jobStoreNextRunTime < nextWakeupTime):
-                nextWakeupTime = jobStoreNextRunTime
+                self.__retryDueEntries(jobStoreName, chunk, now)
+            await asyncio.sleep(0)
+        for result in await asyncio.gather(*[write for write in writes if write is not None], return_exceptions=True):
+            if isinstance(result, Exception):
+                schedulerLogger.warning("Error saving processed jobs to table {}, here is the error message:\n{}".format(
+                    self.__jobStores[jobStoreName].tableName, result))
+        self.__processTimes[jobStoreName].observe(
+            time.perf_counter() - startTime)
+
+    async def __processJobs(self):
+        schedulerLogger.debug("Looking for jobs to run.")
+        now = datetime.utcnow()
+        dueCount = 0
+        self.__touchedJobs = set()
+        try:
+            for jobStoreName, dueEntries in self.__runTimeIndex.popDue(now).items():
+                dueCount += len(dueEntries)
+                await self.__processStoreJobs(jobStoreName, dueEntries, now)
+        finally:
+            self.__touchedJobs = None
+        self.__dueJobs.observe(dueCount)
+        nextWakeupTime = self.__runTimeIndex.peek()
         if nextWakeupTime is not None:
             nextWakeupTime = min(nextWakeupTime, now +
                                  timedelta(seconds=timeoutMax))
@@ -1,32 +1,54 @@
-from tornado import web, ioloop, httpserver
+import time
+import asyncio
+from tornado import web, httpserver, gen
+from tornado.ioloop import IOLoop
+from tornado.util import TimeoutError
+from datetime import timedelta
 from functools import wraps
-from xml.etree.cElementTree import fromstring
 
 
+from configs import config, cacheFilePath, priorityChat, passiveTextReply
 from log import generalLogger
-from crypt import verifyUrl, decryptMsg
-from messager import chat, sendWechatMessage
+from crypt import verifyUrl, decryptMsgAsync, encryptMsgAsync
+from messager import chat, deliverWechatMessage
+from metrics import render
+from dedup import ttlCache, sharedTtlCache
+from decoder import decodeMessage
+from workQueue import boundedWorkQueue
+from cluster import getWorkerCount
 
 
 def getConnectionCount():
-    return connectionCount
+    return connectionCount + len(callbackWorkQueue)
 
 
 def countConnection(func):
     @wraps(func)
-    def wrapper(self, *args, **kwargs):
+    async def wrapper(self, *args, **kwargs):
         global connectionCount
         connectionCount += 1
-        func(self, *args, **kwargs)
-        connectionCount -= 1
+        try:
+            await func(self, *args, **kwargs)
+        finally:
+            connectionCount -= 1
     return wrapper
 
 
+class metricsHandler(web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(render())
+
+
 class callbackHandler(web.RequestHandler):
-    __ioLoop = ioloop.IOLoop.current()
+    def initialize(self):
+        self.__connectionClosed = False
+
+    def on_connection_close(self):
+        self.__connectionClosed = True
 
     @countConnection
-    def get(self):
+    async def get(self):
         msgSignature = self.get_query_argument("msg_signature", None)
         timestamp = self.get_query_argument("timestamp", None)
         nonce = self.get_query_argument("nonce", None)
@@ -40,28 +62,69 @@ class callbackHandler(web.RequestHandler):
             self.write(responseString)
 
     @countConnection
-    def post(self):
+    async def post(self):
         msgSignature = self.get_query_argument("msg_signature", None)
         timestamp = self.get_query_argument("timestamp", None)
         nonce = self.get_query_argument("nonce", None)
-        xmlText = decryptMsg(self.request.body.decode(
-            "utf-8"), msgSignature, timestamp, nonce)
-        if xmlText is not None:
-            xmlTree = fromstring(xmlText)
-            fromId = xmlTree.find("FromUserName").text
-            messageType = xmlTree.find("MsgType").text
+        xmlText = await decryptMsgAsync(self.request.body, msgSignature, timestamp, nonce)
+        message = decodeMessage(xmlText) if xmlText is not None else None
+        if message is not None:
             generalLogger.info("Message parsed successfully!")
-            if messageType == "text":
-                callbackHandler.__ioLoop.add_callback(
-                    chat, fromId, content=xmlTree.find("Content").text)
+            if await callbackCache.seen(message.dedupKey):
+                generalLogger.info(
+                    "Duplicate callback {}, acknowledging it without dispatch.".format(message.dedupKey))
+            elif message.messageType == "text" and config["passiveReplyEnable"]:
+                await self.__replyPassively(message, timestamp, nonce)
+            elif message.messageType == "text":
+                await self.__dispatch(message, chat, message.fromId,
+                                      content=message.content)
             else:
-                callbackHandler.__ioLoop.add_callback(
-                    sendWechatMessage, content="暂不支持非文本类消息哦~", touser=fromId)
+                await self.__dispatch(message, deliverWechatMessage, "暂不支持非文本类消息哦~",
+                                      touser=message.fromId, priority=priorityChat)
         else:
             generalLogger.debug("Input error, ignore this request.")
-        self.set_status(200)
+            self.set_status(200)
+
+    async def __dispatch(self, message, func, *args, **kwargs):
+        if callbackWorkQueue.submit(func, *args, **kwargs):
+            self.set_status(200)
+            return True
+        await callbackCache.forget(message.dedupKey)
+        self.set_status(503)
+        self.write("busy")
+        return False
+
+    async def __replyPassively(self, message, timestamp, nonce):
+        passiveReply = asyncio.get_event_loop().create_future()
+        if not await self.__dispatch(message, chat, message.fromId, content=message.content, passiveReply=passiveReply):
+            return
+        try:
+            reply = await gen.with_timeout(timedelta(seconds=config["passiveReplyTimeout"]), passiveReply)
+        except TimeoutError:
+            passiveReply.cancel()
+            generalLogger.info(
+                "Reply of {} is late, it will be sent through the active api.".format(message))
+            return
+        if reply is None:
+            return
+        replyText = passiveTextReply.format(message.fromId, message.toId if message.toId else config["corpId"], int(
+            time.time()), reply.replace("]]>", "]]]]><![CDATA[>"))
+        packet = await encryptMsgAsync(replyText, nonce, timestamp)
+        if packet is None or self.__connectionClosed:
+            generalLogger.info(
+                "Unable to reply {} passively, it will be sent through the active api.".format(message))
+            IOLoop.current().add_callback(deliverWechatMessage, reply,
+                                          touser=message.fromId, priority=priorityChat)
+            return
+        self.set_header("Content-Type", "application/xml; charset=utf-8")
+        self.write(packet)
+        generalLogger.info("Replied {} passively.".format(message))
 
 
 connectionCount = 0
-__application = web.Application([(r"/callback", callbackHandler)])
+callbackCache = ttlCache("callback") if getWorkerCount() == 1 else sharedTtlCache(
+    "callback", cacheFilePath, config["dedupTableName"])
+callbackWorkQueue = boundedWorkQueue("callback")
+__application = web.Application(
+    [(r"/callback", callbackHandler), (r"/metrics", metricsHandler)])
 httpServer = httpserver.HTTPServer(__application)
@@ -1,4 +1,5 @@
 import random
+import calendar
 from datetime import timedelta, datetime
 from abc import ABCMeta, abstractmethod
 from math import ceil
@@ -13,6 +14,8 @@ def createTrigger(triggerName, triggerArgs):
         return dateTrigger(**triggerArgs)
     elif triggerName == "interval":
         return intervalTrigger(**triggerArgs)
+    elif triggerName == "cron":
+        return cronTrigger(**triggerArgs)
     else:
         schedulerLogger.error(
             "Unsupported trigger type {}".format(triggerName))
@@ -23,7 +26,7 @@ def convertToUtctime(input, utc):
     if input is None:
         return
     elif isinstance(input, datetime):
-        return datetime - timedelta(hours=utc)
+        return input - timedelta(hours=utc)
     elif isinstance(input, str):
         return datetime.strptime(input, "%Y-%m-%d %H:%M:%S") - timedelta(hours=utc)
     else:
@@ -33,6 +36,36 @@ def convertToUtctime(input, utc):
             input.__class__.__name__))
 
 
+def parseCronField(expression, minimum, maximum, names=None):
+    mask = 0
+    for part in str(expression).lower().replace(" ", "").split(","):
+        rangePart, _, stepPart = part.partition("/")
+        step = int(stepPart) if stepPart else 1
+        if rangePart in ("*", "?"):
+            start, end = minimum, maximum
+        else:
+            startPart, _, endPart = rangePart.partition("-")
+            start = names.index(startPart) + minimum if names and startPart in names else int(startPart)
+            if endPart:
+                end = names.index(endPart) + minimum if names and endPart in names else int(endPart)
+            else:
+                end = maximum if stepPart else start
+        if step < 1 or not minimum <= start <= end <= maximum:
+            schedulerLogger.error(
+                "Invalid cron expression {}".format(expression))
+            raise ValueError("Invalid cron expression {}".format(expression))
+        for value in range(start, end + 1, step):
+            mask |= 1 << value
+    return mask
+
+
+def nextBit(mask, value):
+    shiftedMask = mask >> value
+    if not shiftedMask:
+        return None
+    return value + (shiftedMask & -shiftedMask).bit_length() - 1
+
+
 def utctimeToString(utctime):
     return (utctime + timedelta(hours=config["utc"])).strftime(config["logDateFormat"])
 
@@ -42,7 +75,22 @@ class baseTrigger(metaclass=ABCMeta):
     def getNextFireTime(self, previousFireTime, now):
         pass
 
-    def __applyJitter(self, nextFireTime, jitter, now):
+    def getFireSummary(self, firstFireTime, now):
+        fireCount = 0
+        lastFireTime = None
+        for fireTime in self.iterFireTimes(firstFireTime, now):
+            fireCount += 1
+            lastFireTime = fireTime
+        return fireCount, lastFireTime
+
+    def iterFireTimes(self, firstFireTime, now, since=None):
+        fireTime = firstFireTime
+        while fireTime is not None and fireTime <= now:
+            if since is None or fireTime > since:
+                yield fireTime
+            fireTime = self.getNextFireTime(fireTime, now)
+
+    def _applyJitter(self, nextFireTime, jitter, now):
         if nextFireTime is None or not jitter:
             return nextFireTime
         nextFireTimeWithJitter = nextFireTime + \
@@ -100,6 +148,23 @@ class intervalTrigger(baseTrigger):
         self.endDate = state["endDate"]
         self.jitter = state["jitter"]
 
+    def getFireSummary(self, firstFireTime, now):
+        if firstFireTime is None or firstFireTime > now:
+            return 0, None
+        lastTime = now if self.endDate is None else max(
+            min(now, self.endDate), firstFireTime)
+        fireCount = (lastTime - firstFireTime) // self.interval + 1
+        return fireCount, firstFireTime + self.interval * (fireCount - 1)
+
+    def iterFireTimes(self, firstFireTime, now, since=None):
+        fireCount, lastFireTime = self.getFireSummary(firstFireTime, now)
+        index = 0
+        if since is not None and since >= firstFireTime:
+            index = (since - firstFireTime) // self.interval + 1
+        while index < fireCount:
+            yield firstFireTime + self.interval * index
+            index += 1
+
     def getNextFireTime(self, previousFireTime, now):
         if previousFireTime is not None:
             nextFireTime = previousFireTime + self.interval
@@ -109,6 +174,125 @@ class intervalTrigger(baseTrigger):
             timeDiff = now - self.startDate
             nextIntervalNum = ceil(timeDiff / self.interval)
             nextFireTime = self.startDate + self.interval * nextIntervalNum
-        nextFireTime = self.__applyJitter(nextFireTime, self.jitter, now)
+        nextFireTime = self._applyJitter(nextFireTime, self.jitter, now)
+        if self.endDate is None or nextFireTime <= self.endDate:
+            return nextFireTime
+
+
+class cronTrigger(baseTrigger):
+    fieldNames = ("month", "day", "dayOfWeek", "hour", "minute", "second")
+    fieldRanges = {
+        "month": (1, 12, ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")),
+        "day": (1, 31, None),
+        "dayOfWeek": (0, 6, ("mon", "tue", "wed", "thu", "fri", "sat", "sun")),
+        "hour": (0, 23, None),
+        "minute": (0, 59, None),
+        "second": (0, 59, None)
+    }
+    searchYears = 8
+
+    def __init__(self, month=None, day=None, dayOfWeek=None, hour=None, minute=None, second=None, startDate=None, endDate=None, utc=config["utc"], jitter=None):
+        expressions = {"month": month, "day": day, "dayOfWeek": dayOfWeek,
+                       "hour": hour, "minute": minute, "second": second}
+        lastExplicit = max([index for index, fieldName in enumerate(
+            cronTrigger.fieldNames) if expressions[fieldName] is not None], default=-1)
+        self.expressions = {}
+        for index, fieldName in enumerate(cronTrigger.fieldNames):
+            if expressions[fieldName] is not None:
+                self.expressions[fieldName] = expressions[fieldName]
+            elif index > lastExplicit and fieldName != "dayOfWeek":
+                self.expressions[fieldName] = cronTrigger.fieldRanges[fieldName][0]
+            else:
+                self.expressions[fieldName] = "*"
+        self.masks = {fieldName: parseCronField(self.expressions[fieldName], *cronTrigger.fieldRanges[fieldName])
+                      for fieldName in cronTrigger.fieldNames}
+        self.utcOffset = timedelta(hours=utc)
+        self.startDate = convertToUtctime(startDate, utc)
+        self.endDate = convertToUtctime(endDate, utc)
+        self.jitter = jitter
+
+    def __str__(self):
+        return "cron[{}]".format(" ".join(str(self.expressions[fieldName]) for fieldName in ("second", "minute", "hour", "day", "month", "dayOfWeek")))
+
+    def __getstate__(self):
+        return {
+            "expressions": self.expressions,
+            "masks": self.masks,
+            "utcOffset": self.utcOffset,
+            "startDate": self.startDate,
+            "endDate": self.endDate,
+            "jitter": self.jitter
+        }
+
+    def __setstate__(self, state):
+        self.expressions = state["expressions"]
+        self.masks = state["masks"]
+        self.utcOffset = state["utcOffset"]
+        self.startDate = state["startDate"]
+        self.endDate = state["endDate"]
+        self.jitter = state["jitter"]
+
+    def getNextFireTime(self, previousFireTime, now):
+        if previousFireTime is not None:
+            startTime = previousFireTime + \
+                timedelta(seconds=(self.jitter or 0) + 1)
+        else:
+            startTime = now if self.startDate is None else max(
+                now, self.startDate)
+            if startTime.microsecond:
+                startTime += timedelta(seconds=1)
+        nextFireTime = self.__findMatch(
+            (startTime + self.utcOffset).replace(microsecond=0))
+        if nextFireTime is None:
+            return None
+        nextFireTime = self._applyJitter(
+            nextFireTime - self.utcOffset, self.jitter, now)
         if self.endDate is None or nextFireTime <= self.endDate:
             return nextFireTime
+
+    def __matchDay(self, year, month, day):
+        firstWeekday, monthDays = calendar.monthrange(year, month)
+        weekdayMask = self.masks["dayOfWeek"]
+        weekdayDays = 0
+        for weekday in range(7):
+            if weekdayMask >> weekday & 1:
+                for monthDay in range(1 + (weekday - firstWeekday) % 7, monthDays + 1, 7):
+                    weekdayDays |= 1 << monthDay
+        return nextBit(self.masks["day"] & weekdayDays, day)
+
+    def __findMatch(self, localTime):
+        year, month, day = localTime.year, localTime.month, localTime.day
+        hour, minute, second = localTime.hour, localTime.minute, localTime.second
+        while year <= localTime.year + cronTrigger.searchYears:
+            nextMonth = nextBit(self.masks["month"], month)
+            if nextMonth is None:
+                year, month, day, hour, minute, second = year + 1, 1, 1, 0, 0, 0
+                continue
+            if nextMonth != month:
+                month, day, hour, minute, second = nextMonth, 1, 0, 0, 0
+            nextDay = self.__matchDay(year, month, day)
+            if nextDay is None:
+                month, day, hour, minute, second = month + 1, 1, 0, 0, 0
+                if month > 12:
+                    year, month = year + 1, 1
+                continue
+            if nextDay != day:
+                day, hour, minute, second = nextDay, 0, 0, 0
+            nextHour = nextBit(self.masks["hour"], hour)
+            if nextHour is None:
+                day, hour, minute, second = day + 1, 0, 0, 0
+                continue
+            if nextHour != hour:
+                hour, minute, second = nextHour, 0, 0
+            nextMinute = nextBit(self.masks["minute"], minute)
+            if nextMinute is None:
+                hour, minute, second = hour + 1, 0, 0
+                continue
+            if nextMinute != minute:
+                minute, second = nextMinute, 0
+            nextSecond = nextBit(self.masks["second"], second)
+            if nextSecond is None:
+                minute, second = minute + 1, 0
+                continue
+            return datetime(year, month, day, hour, minute, nextSecond)
+        return None
@@ -0,0 +1,129 @@
+import time
+import pickle
+import asyncio
+import aiosqlite
+from tornado.ioloop import IOLoop
+from datetime import datetime
+
+
+from configs import config, getValue, setValue, qywxApiUrl, cacheFilePath, priorityChat
+from log import generalLogger
+from client import httpClient
+from scheduler import taskScheduler
+from cluster import leader
+from retry import retryPolicy, retryableError, circuitOpenError, retryExhaustedError, getBreaker
+
+
+async def refreshWechatToken():
+    await tokenManager.refresh()
+
+
+class wechatTokenManager():
+    persistedKeys = ("wechatToken", "wechatTokenExpireTime",
+                     "wechatTokenAvailable")
+
+    def __init__(self, refreshMargin=None, retryInterval=None):
+        self.refreshMargin = refreshMargin if refreshMargin is not None else config[
+            "wechatTokenRefreshMargin"]
+        self.retryInterval = retryInterval if retryInterval is not None else config[
+            "wechatTokenRetryInterval"]
+        self.__inflight = None
+        self.__listeners = []
+        self.__retryPolicy = retryPolicy()
+
+    @property
+    def token(self):
+        return getValue("wechatToken")
+
+    def isFresh(self):
+        return self.token is not None and getValue("wechatTokenExpireTime", 0) > time.time()
+
+    def addListener(self, listener):
+        self.__listeners.append(listener)
+
+    async def getToken(self):
+        if not (leader.isLeader or self.isFresh() and getValue("wechatTokenAvailable")):
+            await self.reload()
+        if self.isFresh() or not getValue("wechatTokenAvailable"):
+            return self.token
+        generalLogger.info("WechatToken expired, refreshing it before use.")
+        return await self.refresh()
+
+    async def reload(self):
+        try:
+            async with aiosqlite.connect(cacheFilePath) as dataBase:
+                async with dataBase.execute("select key, value from {} where key in (?, ?, ?)".format(config["cacheTableName"]), wechatTokenManager.persistedKeys) as cursor:
+                    async for key, value in cursor:
+                        setValue(key, pickle.loads(value))
+        except Exception as e:
+            generalLogger.warning(
+                "Unable to reload wechatToken, here is the error message:\n{}".format(e))
+
+    async def refresh(self, staleToken=None):
+        if not leader.isLeader:
+            await self.reload()
+        if staleToken is not None and staleToken != self.token and self.isFresh():
+            return self.token
+        if self.__inflight is None:
+            self.__inflight = asyncio.ensure_future(self.__refresh())
+            self.__inflight.add_done_callback(self.__clearInflight)
+        return await asyncio.shield(self.__inflight)
+
+    def __clearInflight(self, future):
+        self.__inflight = None
+
+    async def __refresh(self):
+        try:
+            await self.__retryPolicy.call(getBreaker(qywxApiUrl), self.__fetch)
+        except (circuitOpenError, retryExhaustedError) as e:
+            generalLogger.warning("WechatToken cannot be gotten, will retry in {} seconds, here is the error message:\n{}".format(
+                self.retryInterval, e))
+            setValue("wechatTokenAvailable", False)
+        if getValue("wechatTokenAvailable"):
+            await self.__schedule(getValue("wechatTokenExpireTime") - self.refreshMargin)
+            for listener in self.__listeners:
+                IOLoop.current().add_callback(listener)
+        else:
+            await self.__schedule(time.time() + self.retryInterval)
+        await self.__persist()
+        return self.token if getValue("wechatTokenAvailable") else None
+
+    async def __fetch(self):
+        getUrlParameters = "gettoken?corpid={}&corpsecret={}".format(
+            config["corpId"], config["secret"])
+        getUrl = "/".join((qywxApiUrl, getUrlParameters))
+        response = await httpClient.get(getUrl, priority=priorityChat)
+        responseDict = await response.json()
+        if responseDict["errcode"] == 0:
+            generalLogger.info("WechatToken gotten!")
+            setValue("wechatToken", responseDict["access_token"])
+            setValue("wechatTokenExpireTime",
+                     time.time() + responseDict["expires_in"])
+            setValue("wechatTokenAvailable", True)
+        elif responseDict["errcode"] == -1:
+            raise retryableError("Wechat api system busy.")
+        else:
+            generalLogger.warning("An unresolved error occurred, here is the error code: {}".format(
+                responseDict["errcode"]))
+            setValue("wechatTokenAvailable", False)
+
+    async def __schedule(self, runTimestamp):
+        if not leader.isLeader:
+            return
+        runDate = datetime.utcfromtimestamp(max(runTimestamp, time.time()))
+        await taskScheduler.addJob("refreshWechatToken", refreshWechatToken, description="Refresh wechatToken ahead of expiry",
+                                   triggerName="date", runDate=runDate, utc=0, replaceExisting=True)
+
+    async def __persist(self):
+        rows = [(key, pickle.dumps(getValue(key), pickle.HIGHEST_PROTOCOL))
+                for key in wechatTokenManager.persistedKeys]
+        try:
+            async with aiosqlite.connect(cacheFilePath) as dataBase:
+                await dataBase.executemany("insert or replace into {} values (?, ?)".format(config["cacheTableName"]), rows)
+                await dataBase.commit()
+        except Exception as e:
+            generalLogger.warning(
+                "Unable to persist wechatToken, here is the error message:\n{}".format(e))
+
+
+tokenManager = wechatTokenManager()
@@ -0,0 +1,60 @@
+import asyncio
+from tornado.queues import Queue, QueueFull
+
+
+from configs import config
+from log import generalLogger
+from metrics import counter, gauge
+
+
+class boundedWorkQueue():
+    def __init__(self, name, maxSize=None, workers=None):
+        self.name = name
+        self.maxSize = maxSize if maxSize is not None else config["workQueueSize"]
+        self.workers = workers if workers is not None else config["workQueueWorkers"]
+        self.__queue = Queue(maxsize=self.maxSize)
+        self.__workerTasks = []
+        self.__inFlight = 0
+        self.__depth = gauge("work_queue_in_flight",
+                             "Background tasks queued or running.", queue=name)
+        self.__rejected = counter("work_queue_rejected_total",
+                                  "Background tasks rejected because the queue was full.", queue=name)
+
+    def __len__(self):
+        return self.__inFlight
+
+    def start(self):
+        for _ in range(self.workers):
+            self.__workerTasks.append(asyncio.ensure_future(self.__work()))
+
+    async def close(self):
+        await self.__queue.join()
+        for task in self.__workerTasks:
+            task.cancel()
+        await asyncio.gather(*self.__workerTasks, return_exceptions=True)
+        self.__workerTasks = []
+
+    def submit(self, func, *args, **kwargs):
+        try:
+            self.__queue.put_nowait((func, args, kwargs))
+        except QueueFull:
+            self.__rejected.inc()
+            generalLogger.warning(
+                "Work queue {} is full, rejecting this task.".format(self.name))
+            return False
+        self.__inFlight += 1
+        self.__depth.set(self.__inFlight)
+        return True
+
+    async def __work(self):
+        while True:
+            func, args, kwargs = await self.__queue.get()
+            try:
+                await func(*args, **kwargs)
+            except Exception as e:
+                generalLogger.error("Background task {} failed, here is the error message:\n{}".format(
+                    func.__name__, e))
+            finally:
+                self.__inFlight -= 1
+                self.__depth.set(self.__inFlight)
+                self.__queue.task_done()